@@ -1,139 +1,152 @@
-import os
-import requests
 from PIL import Image
 import io
-from typing import Optional
+from typing import Dict, List, Optional, Tuple
+from api import palette
+from api.cache import TTLCache
+from api.executor import run_io
+from api.store import store
+from api.thumbnails import fetch_thumbnail
 
-ARTWORK_CACHE_DIR = os.path.join("cache", "artwork")
-os.makedirs(ARTWORK_CACHE_DIR, exist_ok=True)
+ARTWORK_MODES = ("ascii", "teletext")
+# Largest render (about an 8x6 monitor wall at text scale 0.5)
+MAX_ARTWORK_WIDTH = 164
+MAX_ARTWORK_HEIGHT = 81
 
-# Color mapping for CC:Tweaked colors
-CC_COLORS = {
-    0: '0',  # black
-    1: '1',  # blue
-    2: '2',  # brown
-    3: '3',  # cyan
-    4: '4',  # gray
-    5: '5',  # green
-    6: '6',  # lightBlue
-    7: '7',  # lightGray
-    8: '8',  # lime
-    9: '9',  # magenta
-    10: 'a', # orange
-    11: 'b', # pink
-    12: 'c', # purple
-    13: 'd', # red
-    14: 'e', # yellow
-    15: 'f', # white
-}
+# Decoded thumbnails are kept at this size (big enough for a full-size teletext render)
+SOURCE_SIZE = (480, 360)
+_sources = TTLCache(3600, max_entries=32)
 
-def rgb_to_cc_color(r: int, g: int, b: int) -> str:
-    """Convert RGB to closest CC:Tweaked color"""
-    # Simple color distance calculation
-    colors = {
-        (0, 0, 0): '0',      # black
-        (0, 0, 170): '1',    # blue
-        (102, 67, 0): '2',   # brown
-        (0, 170, 170): '3',  # cyan
-        (85, 85, 85): '4',   # gray
-        (0, 170, 0): '5',    # green
-        (102, 102, 255): '6', # lightBlue
-        (170, 170, 170): '7', # lightGray
-        (170, 255, 0): '8',  # lime
-        (170, 0, 170): '9',  # magenta
-        (255, 102, 0): 'a',  # orange
-        (255, 192, 203): 'b', # pink
-        (170, 0, 170): 'c',  # purple
-        (255, 0, 0): 'd',    # red
-        (255, 255, 0): 'e',  # yellow
-        (255, 255, 255): 'f', # white
-    }
-    
-    min_dist = float('inf')
-    closest = '0'
-    
-    for (cr, cg, cb), color in colors.items():
-        dist = ((r - cr) ** 2 + (g - cg) ** 2 + (b - cb) ** 2) ** 0.5
-        if dist < min_dist:
-            min_dist = dist
-            closest = color
-    
-    return closest
-
-async def get_artwork(video_id: str) -> str:
+async def get_artwork(video_id: str, width: int = 20, height: int = 10,
+                      mode: str = "ascii", dither: bool = False) -> str:
     """
-    Get ASCII artwork for a video.
+    Get artwork for a video, width x height characters.
+    mode: "ascii" (brightness characters on colored background) or "teletext"
+    (CC drawing characters with 2x3 sub-pixels per character).
+    Every size/mode is rendered from one decoded thumbnail per video.
     Returns: Multi-line string with format "text|fg|bg" per line
     """
-    cache_file = os.path.join(ARTWORK_CACHE_DIR, f"{video_id}.txt")
-    if os.path.exists(cache_file):
-        with open(cache_file, 'r', encoding='utf-8') as f:
-            return f.read()
+    if mode not in ARTWORK_MODES:
+        raise ValueError(f"Unknown artwork mode: {mode}")
+    
+    cache_key = f"{video_id}:{mode}:{width}x{height}" + (":dither" if dither else "")
+    cached_artwork = store.get("artwork", cache_key)
+    if cached_artwork is not None:
+        return cached_artwork
     
     try:
-        # Try to get thumbnail from YouTube
-        thumbnail_url = f"https://img.youtube.com/vi/{video_id}/maxresdefault.jpg"
+        source = await _sources.get_or_load(video_id, lambda: _load_source(video_id))
+        if source is None:
+            return ""
         
-        # Try maxresdefault first, fallback to hqdefault
-        response = requests.get(thumbnail_url, timeout=5)
-        if response.status_code != 200:
-            thumbnail_url = f"https://img.youtube.com/vi/{video_id}/hqdefault.jpg"
-            response = requests.get(thumbnail_url, timeout=5)
+        # Resizing and quantizing is CPU work, keep it off the event loop
+        render = render_teletext if mode == "teletext" else render_ascii
+        artwork_text = await run_io(render, source, width, height, dither)
         
-        if response.status_code == 200:
-            # Convert image to ASCII art
-            img = Image.open(io.BytesIO(response.content))
-            
-            # Resize to fit terminal (typical monitor is ~51x19 for scale 0.5)
-            # Use a reasonable size for artwork
-            target_width = 20
-            target_height = 10
-            
-            img = img.resize((target_width, target_height), Image.Resampling.LANCZOS)
-            img = img.convert('RGB')
-            
-            # Convert to ASCII with colors
-            ascii_lines = []
-            pixels = img.load()
-            
-            # ASCII characters from dark to light
-            ascii_chars = " .:-=+*#%@"
-            
-            for y in range(target_height):
-                line_text = ""
-                line_fg = ""
-                line_bg = ""
-                
-                for x in range(target_width):
-                    r, g, b = pixels[x, y]
-                    
-                    # Calculate brightness
-                    brightness = (r + g + b) / 3.0
-                    char_idx = int((brightness / 255.0) * (len(ascii_chars) - 1))
-                    char = ascii_chars[char_idx]
-                    
-                    # Use background color based on pixel color
-                    bg_color = rgb_to_cc_color(r, g, b)
-                    fg_color = '0' if brightness > 128 else 'f'  # Black text on light, white on dark
-                    
-                    line_text += char
-                    line_fg += fg_color
-                    line_bg += bg_color
-                
-                # Format: text|fg|bg
-                ascii_lines.append(f"{line_text}|{line_fg}|{line_bg}")
-            
-            artwork_text = "\n".join(ascii_lines)
-            
-            # Cache artwork
-            with open(cache_file, 'w', encoding='utf-8') as f:
-                f.write(artwork_text)
-            
-            return artwork_text
-        else:
-            return ""
+        # Cache artwork
+        store.put("artwork", cache_key, artwork_text)
+        
+        return artwork_text
             
     except Exception as e:
         print(f"Artwork error for {video_id}: {e}")
         return ""
 
+async def _load_source(video_id: str) -> Optional[Image.Image]:
+    """Fetch and decode a video's thumbnail (None if there is none)"""
+    image_data = await run_io(fetch_thumbnail, video_id)
+    if image_data is None:
+        return None
+    return await run_io(decode_source, image_data)
+
+def decode_source(image_data: bytes) -> Image.Image:
+    """Decode a thumbnail into a small RGB image that every render is resized from"""
+    img = Image.open(io.BytesIO(image_data))
+    # Let the JPEG decoder downscale while decoding
+    img.draft('RGB', SOURCE_SIZE)
+    img = img.convert('RGB')
+    img.thumbnail(SOURCE_SIZE, Image.Resampling.LANCZOS)
+    return img
+
+def render_ascii(source: Image.Image, width: int = 20, height: int = 10, dither: bool = False) -> str:
+    """
+    Render ASCII art lines in "text|fg|bg" format.
+    Colors are quantized for the whole image at once (see api.palette).
+    """
+    # Typical monitor is ~51x19 for scale 0.5
+    img = source.resize((width, height), Image.Resampling.LANCZOS)
+    
+    colors = palette.quantize(img, dither)
+    levels = palette.brightness(img)
+    
+    # ASCII characters from dark to light
+    ascii_chars = " .:-=+*#%@"
+    scale = (len(ascii_chars) - 1) / 255.0
+    dark = palette.BLIT_CHARS[palette.BLACK]
+    light = palette.BLIT_CHARS[palette.WHITE]
+    
+    ascii_lines = []
+    for color_row, level_row in zip(colors, levels):
+        line_text = "".join(ascii_chars[int(level * scale)] for level in level_row)
+        # Black text on light, white on dark
+        line_fg = "".join(dark if level > 128 else light for level in level_row)
+        # Use background color based on pixel color
+        line_bg = "".join(palette.BLIT_CHARS[index] for index in color_row)
+        
+        # Format: text|fg|bg
+        ascii_lines.append(f"{line_text}|{line_fg}|{line_bg}")
+    
+    return "\n".join(ascii_lines)
+
+def render_teletext(source: Image.Image, width: int = 20, height: int = 10, dither: bool = False) -> str:
+    """
+    Render lines in "text|fg|bg" format using CC's drawing characters
+    (0x80-0x9F): each character is a 2x3 grid of sub-pixels in two colors.
+    """
+    img = source.resize((width * 2, height * 3), Image.Resampling.LANCZOS)
+    colors = palette.quantize(img, dither)
+    
+    lines = []
+    for y in range(height):
+        rows = colors[y * 3:y * 3 + 3]
+        line_text = []
+        line_fg = []
+        line_bg = []
+        for x in range(width):
+            # Sub-pixels in bit order: top-left, top-right, middle-left, ... bottom-right
+            cell = [row[x * 2 + dx] for row in rows for dx in (0, 1)]
+            char, fg, bg = _teletext_cell(cell)
+            line_text.append(char)
+            line_fg.append(palette.BLIT_CHARS[fg])
+            line_bg.append(palette.BLIT_CHARS[bg])
+        lines.append(f"{''.join(line_text)}|{''.join(line_fg)}|{''.join(line_bg)}")
+    
+    return "\n".join(lines)
+
+def _teletext_cell(cell: List[int]) -> Tuple[str, int, int]:
+    """Drawing character, foreground and background color for six sub-pixel colors"""
+    counts: Dict[int, int] = {}
+    for color in cell:
+        counts[color] = counts.get(color, 0) + 1
+    ranked = sorted(counts, key=lambda color: -counts[color])
+    if len(ranked) == 1:
+        return chr(0x80), ranked[0], ranked[0]
+    
+    # The two most common colors; any others take whichever of the two is closer
+    first, second = ranked[0], ranked[1]
+    bits = 0
+    for i, color in enumerate(cell):
+        if color != first and color != second:
+            color = first if _distance(color, first) <= _distance(color, second) else second
+        if color == second:
+            bits |= 1 << i
+    
+    # The bottom-right sub-pixel is always background, so invert if it's foreground
+    fg, bg = second, first
+    if bits & 0x20:
+        bits ^= 0x3F
+        fg, bg = bg, fg
+    return chr(0x80 + bits), fg, bg
+
+def _distance(a: int, b: int) -> int:
+    (ar, ag, ab), (br, bg, bb) = palette.PALETTE[a], palette.PALETTE[b]
+    return (ar - br) ** 2 + (ag - bg) ** 2 + (ab - bb) ** 2
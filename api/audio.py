@@ -1,10 +1,20 @@
 import os
+import asyncio
 import subprocess
-import struct
-from typing import Optional, Dict
+import threading
+import time
+from collections import deque
+from typing import Callable, Optional, Dict, Tuple
+from api import dfpwm
+from api.executor import submit_io, cpu_call
+from api.blockcache import block_cache
+from api.janitor import janitor, AUDIO, DFPWM
 
 AUDIO_CACHE_DIR = os.path.join("cache", "audio")
 DFPWM_CACHE_DIR = os.path.join("cache", "dfpwm")
+# Source audio the downloader can leave in AUDIO_CACHE_DIR, in lookup order
+# (mp4 when a video has no audio-only format and the "best" fallback is used)
+AUDIO_EXTENSIONS = ('.m4a', '.mp3', '.webm', '.opus', '.mp4')
 os.makedirs(DFPWM_CACHE_DIR, exist_ok=True)
 
 # Track which videos we've already warned about to reduce log spam
@@ -12,7 +22,87 @@ _warned_videos = set()
 
 # DFPWM encoding parameters
 SAMPLE_RATE = 48000
-BYTES_PER_SAMPLE = 1  # DFPWM is 8-bit
+PCM_BLOCK_SIZE = 256 * 1024  # Bytes of interleaved 16-bit stereo PCM encoded per block
+
+# How long a chunk request waits for bytes that haven't been encoded yet
+CHUNK_WAIT_TIMEOUT = 5.0
+CHUNK_POLL_INTERVAL = 0.05
+# Seconds a whole-file download is told to retry after while the audio downloads
+DOWNLOAD_RETRY_AFTER = 2
+
+# Lines of ffmpeg's stderr kept for the error raised when it fails
+FFMPEG_STDERR_TAIL = 20
+
+# Read size for whole-file DFPWM downloads
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# Streams audio bytes into the write function it's given
+AudioSource = Callable[[Callable[[bytes], None]], None]
+
+# Channel variants produced by every conversion (None = mono mix)
+CHANNELS = (None, 'left', 'right')
+
+class ConversionJob:
+    """
+    A DFPWM conversion running in the background, readable while it grows.
+    One job decodes the source once and fills the mono, left and right
+    outputs together; all three always hold the same number of bytes.
+    Output goes to temporary files that are atomically renamed into place
+    when the conversion succeeds, so a half-written file is never served.
+    """
+
+    def __init__(self, video_id: str):
+        self.video_id = video_id
+        self.dfpwm_files = {channel: get_dfpwm_path(video_id, channel) for channel in CHANNELS}
+        self.temp_files = {channel: path + ".part" for channel, path in self.dfpwm_files.items()}
+        self.bytes_ready = 0  # Encoded bytes flushed to each temp file so far
+        self.done = False
+        self.error = None
+        self.finished = threading.Event()
+        self._lock = threading.Lock()
+
+    def add_progress(self, num_bytes: int):
+        self.bytes_ready += num_bytes
+
+    def finish(self, error: Optional[str] = None):
+        """Publish the outputs (or discard them on error) and wake up waiters"""
+        with self._lock:
+            for channel, temp_file in self.temp_files.items():
+                if error is None:
+                    os.replace(temp_file, self.dfpwm_files[channel])
+                elif os.path.exists(temp_file):
+                    os.remove(temp_file)
+            self.error = error
+            self.done = True
+        # Blocks cached from an older copy of these files are stale now
+        block_cache.invalidate(self.video_id)
+        if error is None:
+            # Streamed conversions also saved the source audio
+            janitor.refresh(DFPWM, self.video_id)
+            janitor.refresh(AUDIO, self.video_id)
+        self.finished.set()
+
+    def read(self, channel: Optional[str], offset: int, size: int) -> bytes:
+        """Read encoded bytes for a channel, from the temp file or the published file"""
+        with self._lock:
+            size = min(size, self.bytes_ready - offset)
+            if size <= 0 or self.error:
+                return b""
+            path = self.dfpwm_files[channel] if self.done else self.temp_files[channel]
+            with open(path, 'rb') as f:
+                f.seek(offset)
+                return f.read(size)
+
+    async def wait_for(self, num_bytes: int, timeout: float = CHUNK_WAIT_TIMEOUT):
+        """Wait until num_bytes are encoded, the job ends, or the timeout passes"""
+        deadline = time.monotonic() + timeout
+        while self.bytes_ready < num_bytes and not self.done and time.monotonic() < deadline:
+            await asyncio.sleep(CHUNK_POLL_INTERVAL)
+
+# Single-flight registry: one conversion per video_id.
+# Failed jobs stay registered until a request has reported the error (see forget_failed_job).
+_jobs: Dict[str, ConversionJob] = {}
+_jobs_lock = threading.Lock()
 
 async def get_audio_chunk(video_id: str, offset: int, size: int, channel: Optional[str] = None) -> Dict:
     """
@@ -23,152 +113,359 @@ async def get_audio_chunk(video_id: str, offset: int, size: int, channel: Option
     
     Returns: {data: hex_string, done: bool}
     """
+    chunk = await read_audio_chunk(video_id, offset, size, channel)
+    result = {
+        "data": chunk["data"].hex(),
+        "done": chunk["done"]
+    }
+    if "error" in chunk:
+        result["error"] = chunk["error"]
+    return result
+
+async def get_stereo_chunk(video_id: str, offset: int, size: int) -> Dict:
+    """
+    Get left and right audio chunks for the same offset in one request.
+    Returns: {left: hex_string, right: hex_string, done: bool}
+    """
+    chunk = await read_stereo_chunk(video_id, offset, size)
+    result = {
+        "left": chunk["left"].hex(),
+        "right": chunk["right"].hex(),
+        "done": chunk["done"]
+    }
+    if "error" in chunk:
+        result["error"] = chunk["error"]
+    return result
+
+async def read_audio_chunk(video_id: str, offset: int, size: int, channel: Optional[str] = None) -> Dict:
+    """
+    Read raw DFPWM bytes straight from the cached (or growing) file.
+    Chunks are served while the conversion is still running; requests for
+    bytes that aren't encoded yet wait up to CHUNK_WAIT_TIMEOUT seconds.
+    
+    Returns: {data: bytes, done: bool, ready: int, total: int|None, error?: str}
+    ready is the number of bytes encoded so far, total is only known once
+    the conversion has finished.
+    """
+    if channel not in CHANNELS:
+        return {"data": b"", "done": True, "ready": 0, "total": None, "error": f"Invalid channel: {channel}"}
+    
+    result = await _read_channels(video_id, offset, size, (channel,))
+    result["data"] = result.pop("chunks")[0]
+    return result
+
+async def read_stereo_chunk(video_id: str, offset: int, size: int) -> Dict:
+    """
+    Read raw left and right DFPWM bytes for the same offset range.
+    Both channels always come back with the same length.
+    Returns: {left: bytes, right: bytes, done: bool, ready: int, total: int|None, error?: str}
+    """
+    result = await _read_channels(video_id, offset, size, ('left', 'right'))
+    result["left"], result["right"] = result.pop("chunks")
+    return result
+
+async def _read_channels(video_id: str, offset: int, size: int, channels: Tuple[Optional[str], ...]) -> Dict:
+    """Read the same byte range from one or more channel variants"""
+    empty = [b"" for _ in channels]
     try:
-        # Ensure audio is converted to DFPWM
-        dfpwm_file = ensure_dfpwm_ready(video_id, channel)
+        dfpwm_files = [get_dfpwm_path(video_id, channel) for channel in channels]
+        job = get_conversion_job(video_id)
+        if job is not None and job.error and is_download_pending(video_id):
+            job = None  # Streamed conversion failed, the scheduler falls back to a plain download
         
-        if not dfpwm_file or not os.path.exists(dfpwm_file):
-            # Check if audio file exists - if not, audio download may have failed
-            audio_file = None
-            for ext in ['m4a', 'mp3', 'webm', 'opus']:
-                test_file = os.path.join(AUDIO_CACHE_DIR, f"{video_id}.{ext}")
-                if os.path.exists(test_file):
-                    audio_file = test_file
-                    break
+        if job is None and not all(os.path.exists(path) for path in dfpwm_files):
+            job = start_dfpwm_conversion(video_id)
             
-            if not audio_file:
+            if job is None and not all(os.path.exists(path) for path in dfpwm_files):
+                if is_download_pending(video_id):
+                    # Download queued or starting; its conversion will show up shortly
+                    job = await _wait_for_job(video_id)
+                    if job is None:
+                        return {"chunks": empty, "done": False, "ready": 0, "total": None}
+            
+            if job is None and not all(os.path.exists(path) for path in dfpwm_files):
                 # Audio file doesn't exist - download may have failed
                 # Only warn once per video to reduce log spam
                 if video_id not in _warned_videos:
                     print(f"Warning: Audio file not found for {video_id}, chunks will be empty (YouTube bot detection blocking downloads)")
                     _warned_videos.add(video_id)
-                return {"data": "", "done": True, "error": "Audio file not available"}
-            
-            # Audio exists but DFPWM not converted yet - return empty for now
-            return {"data": "", "done": False}
-        
-        file_size = os.path.getsize(dfpwm_file)
-        
-        # Check if we're past the end
-        if offset >= file_size:
-            return {"data": "", "done": True}
+                return {"chunks": empty, "done": True, "ready": 0, "total": None, "error": "Audio file not available"}
         
-        # Read chunk
-        with open(dfpwm_file, 'rb') as f:
-            f.seek(offset)
-            chunk_data = f.read(size)
-        
-        # Convert to hex string
-        hex_data = chunk_data.hex()
+        chunks = []
+        if job is not None:
+            await job.wait_for(offset + size)
+            if job.error and is_download_pending(video_id):
+                return {"chunks": empty, "done": False, "ready": 0, "total": None}
+            if job.error:
+                forget_failed_job(job)
+                return {"chunks": empty, "done": True, "ready": 0, "total": None, "error": job.error}
+            complete = job.done
+            available = job.bytes_ready
+            for channel in channels:
+                chunks.append(job.read(channel, offset, size))
+                # More bytes may have been encoded meanwhile; keep channels the same length
+                size = len(chunks[0])
+        else:
+            complete = True
+            available = os.path.getsize(dfpwm_files[0])
+            janitor.touch(DFPWM, video_id)
+            for channel, path in zip(channels, dfpwm_files):
+                data = b""
+                if offset < available:
+                    data = block_cache.read(video_id, channel, path, offset, min(size, available - offset))
+                chunks.append(data)
         
-        # Check if this is the last chunk
-        done = (offset + len(chunk_data)) >= file_size
+        # Last chunk, or past the end (an empty chunk before the end means "not encoded yet")
+        done = complete and (offset + len(chunks[0])) >= available
         
         return {
-            "data": hex_data,
-            "done": done
+            "chunks": chunks,
+            "done": done,
+            "ready": available,
+            "total": available if complete else None
         }
         
     except Exception as e:
         print(f"Audio chunk error for {video_id}: {e}")
-        return {"data": "", "done": True, "error": str(e)}
+        return {"chunks": empty, "done": True, "ready": 0, "total": None, "error": str(e)}
+
+def is_download_pending(video_id: str) -> bool:
+    """Check whether the download scheduler is still working on a video"""
+    # Imported here: api.downloads builds on this module
+    from api.downloads import download_scheduler, FAILED, READY
+    job = download_scheduler.get_job(video_id)
+    return job is not None and job.status not in (FAILED, READY)
+
+async def _wait_for_job(video_id: str, timeout: float = CHUNK_WAIT_TIMEOUT) -> Optional[ConversionJob]:
+    """Wait for a pending download to start (or finish into) a conversion"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = start_dfpwm_conversion(video_id)
+        if job is not None or not is_download_pending(video_id):
+            return job
+        await asyncio.sleep(CHUNK_POLL_INTERVAL)
+    return None
 
-def ensure_dfpwm_ready(video_id: str, channel: Optional[str] = None) -> Optional[str]:
-    """Ensure DFPWM file exists, create if needed"""
+async def get_dfpwm_file(video_id: str, channel: Optional[str] = None) -> Tuple[Optional[str], Optional[ConversionJob]]:
+    """
+    Locate a video's DFPWM for whole-file download, starting the conversion if needed.
+    While the download is queued, waits up to CHUNK_WAIT_TIMEOUT for its conversion.
+    Returns: (path, None) if the file is complete, (None, job) while it's
+    being converted, or (None, None) if the source audio isn't available
+    (yet: see is_download_pending). A failed conversion is retried, like chunk requests do.
+    """
+    dfpwm_file = get_dfpwm_path(video_id, channel)
+    job = get_conversion_job(video_id)
+    if job is not None and job.error:
+        forget_failed_job(job)
+        job = None
+    if job is None:
+        if os.path.exists(dfpwm_file):
+            janitor.touch(DFPWM, video_id)
+            return dfpwm_file, None
+        job = start_dfpwm_conversion(video_id)
+        if job is None and is_download_pending(video_id):
+            job = await _wait_for_job(video_id)
+        if job is None:
+            return (dfpwm_file, None) if os.path.exists(dfpwm_file) else (None, None)
+    return None, job
+
+def iter_dfpwm_file(path: str, start: int, end: int, block_size: int = STREAM_BLOCK_SIZE):
+    """Yield bytes start..end (inclusive) of a completed DFPWM file"""
+    with open(path, 'rb') as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(block_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+async def iter_dfpwm_job(job: ConversionJob, channel: Optional[str] = None, block_size: int = STREAM_BLOCK_SIZE):
+    """Yield a channel's DFPWM bytes as the conversion produces them, until it finishes"""
+    offset = 0
+    while True:
+        await job.wait_for(offset + block_size)
+        if job.error:
+            # Abort the response so the client can't mistake it for a complete (shorter) track
+            forget_failed_job(job)
+            raise IOError(f"DFPWM conversion failed for {job.video_id}: {job.error}")
+        data = job.read(channel, offset, block_size)
+        if data:
+            offset += len(data)
+            yield data
+        elif job.done:
+            return
+
+def get_dfpwm_path(video_id: str, channel: Optional[str] = None) -> str:
+    """Path of the cached DFPWM file for a video/channel"""
     if channel:
-        dfpwm_file = os.path.join(DFPWM_CACHE_DIR, f"{video_id}_{channel}.dfpwm")
-    else:
-        dfpwm_file = os.path.join(DFPWM_CACHE_DIR, f"{video_id}.dfpwm")
+        return os.path.join(DFPWM_CACHE_DIR, f"{video_id}_{channel}.dfpwm")
+    return os.path.join(DFPWM_CACHE_DIR, f"{video_id}.dfpwm")
+
+def find_audio_file(video_id: str) -> Optional[str]:
+    """Find the downloaded source audio for a video"""
+    for ext in AUDIO_EXTENSIONS:
+        test_file = os.path.join(AUDIO_CACHE_DIR, f"{video_id}{ext}")
+        if os.path.exists(test_file):
+            return test_file
+    return None
+
+def get_conversion_job(video_id: str) -> Optional[ConversionJob]:
+    """Get the in-flight (or failed) conversion for a video, if any"""
+    with _jobs_lock:
+        return _jobs.get(video_id)
+
+def is_dfpwm_complete(video_id: str) -> bool:
+    """Check whether every channel variant of a video has been converted"""
+    return all(os.path.exists(get_dfpwm_path(video_id, channel)) for channel in CHANNELS)
+
+def start_dfpwm_conversion(video_id: str, source: Optional[AudioSource] = None) -> Optional[ConversionJob]:
+    """
+    Start converting a video to DFPWM (all channel variants) in the background,
+    unless a conversion for the same video is already running - then return that one.
+    A previously failed conversion is retried.
+    source: optional function that streams the audio bytes into the write
+    function it is given (download-while-encode); otherwise the downloaded
+    file in the audio cache is used.
+    Returns None if the DFPWM files are already complete or the source audio
+    isn't downloaded yet.
+    """
+    with _jobs_lock:
+        job = _jobs.get(video_id)
+        if job is not None and job.error is None:
+            return job
+        
+        if is_dfpwm_complete(video_id):
+            return None
+        
+        audio_file = find_audio_file(video_id)
+        if audio_file:
+            source = None  # Already downloaded, no need to stream it again
+        elif source is None:
+            return None
+        
+        job = ConversionJob(video_id)
+        _jobs[video_id] = job
     
-    if os.path.exists(dfpwm_file):
-        return dfpwm_file
+    if audio_file:
+        janitor.touch(AUDIO, video_id)
+    submit_io(_run_conversion, job, audio_file, source)
+    return job
+
+def _run_conversion(job: ConversionJob, audio_file: Optional[str], source: Optional[AudioSource]):
+    """Conversion job body (runs in the I/O pool)"""
+    try:
+        convert_to_dfpwm(audio_file, job.temp_files, job.add_progress, source)
+        job.finish()
+    except Exception as e:
+        print(f"DFPWM conversion error for {job.video_id}: {e}")
+        job.finish(str(e))
+        return
     
-    # Find source audio file
-    audio_file = None
-    for ext in ['m4a', 'mp3', 'webm', 'opus']:
-        test_file = os.path.join(AUDIO_CACHE_DIR, f"{video_id}.{ext}")
-        if os.path.exists(test_file):
-            audio_file = test_file
-            break
+    with _jobs_lock:
+        _jobs.pop(job.video_id, None)
+
+def forget_failed_job(job: ConversionJob):
+    """Unregister a failed conversion once its error has been reported"""
+    with _jobs_lock:
+        if _jobs.get(job.video_id) is job:
+            del _jobs[job.video_id]
+
+def convert_to_dfpwm(audio_file: Optional[str], dfpwm_files: Dict[Optional[str], str], progress=None,
+                     source: Optional[AudioSource] = None):
+    """
+    Decode audio with ffmpeg once and encode mono, left and right DFPWM while it decodes.
+    Interleaved stereo PCM is read from ffmpeg's stdout in fixed-size blocks, so
+    nothing is written to disk except the DFPWM outputs and memory use stays bounded.
+    dfpwm_files: output path per channel in CHANNELS
+    progress: optional callback given the number of bytes flushed per channel after each block
+    source: if given, audio bytes are streamed into ffmpeg's stdin by this
+    function (from a feeder thread) instead of ffmpeg reading audio_file
+    """
+    cmd = [
+        'ffmpeg', '-loglevel', 'error',
+        '-i', audio_file if source is None else 'pipe:0',
+        '-f', 's16le',  # 16-bit signed little-endian PCM
+        '-ar', str(SAMPLE_RATE),
+        '-ac', '2',  # Interleaved stereo (mono sources are duplicated)
+        'pipe:1'
+    ]
     
-    if not audio_file:
-        # Audio not downloaded yet, return None
-        return None
+    process = subprocess.Popen(cmd, stdin=subprocess.DEVNULL if source is None else subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    # stderr is drained by its own thread: a chatty ffmpeg would otherwise block
+    # writing to a full pipe while we wait on stdout
+    stderr_tail = deque(maxlen=FFMPEG_STDERR_TAIL)
+    drainer = threading.Thread(target=_drain_stderr, args=(process, stderr_tail))
+    drainer.daemon = True
+    drainer.start()
+    feeder = None
+    feed_errors = []
+    if source is not None:
+        feeder = threading.Thread(target=_feed_ffmpeg, args=(process, source, feed_errors))
+        feeder.daemon = True
+        feeder.start()
     
+    outputs = [open(dfpwm_files[channel], 'wb') for channel in CHANNELS]
     try:
-        # Convert to DFPWM using ffmpeg
-        # DFPWM is a specific format - we'll convert to raw PCM first, then to DFPWM
-        # For now, we'll use a simpler approach: convert to mono/stereo PCM and encode
-        
-        if channel:
-            # Extract specific channel for stereo
-            pcm_file = dfpwm_file.replace('.dfpwm', f'_{channel}.pcm')
-            if channel == 'left':
-                pan_filter = 'pan=mono|c0=0.5*c0'
-            else:  # right
-                pan_filter = 'pan=mono|c0=0.5*c1'
-        else:
-            # Mono - mix both channels
-            pcm_file = dfpwm_file.replace('.dfpwm', '.pcm')
-            pan_filter = 'pan=mono|c0=0.5*c0+0.5*c1'
-        
-        # Convert to PCM first
-        cmd_pcm = [
-            'ffmpeg', '-i', audio_file,
-            '-f', 's16le',  # 16-bit signed little-endian PCM
-            '-ar', str(SAMPLE_RATE),
-            '-af', pan_filter,
-            '-y',  # Overwrite
-            pcm_file
-        ]
-        
-        subprocess.run(cmd_pcm, capture_output=True, check=True)
-        
-        # Convert PCM to DFPWM
-        # DFPWM (Differential Pulse-Width Modulation) encoder
-        # This is a simplified DFPWM1a encoder
-        with open(pcm_file, 'rb') as f_in, open(dfpwm_file, 'wb') as f_out:
-            # DFPWM state
-            charge = 0
-            strength = 0
-            
-            # Read 16-bit PCM samples
-            while True:
-                chunk = f_in.read(2)
-                if len(chunk) < 2:
-                    break
-                
-                # Convert 16-bit PCM to signed sample (-32768 to 32767)
-                sample = struct.unpack('<h', chunk)[0]
-                # Normalize to -128 to 127 range
-                target = (sample >> 8) & 0xFF
-                if sample < 0:
-                    target = target | 0x80
-                
-                # DFPWM encoding
-                diff = target - charge
-                if diff > 0:
-                    output = 0xFF
-                    charge += min(diff, strength + 1)
-                else:
-                    output = 0x00
-                    charge += max(diff, -strength - 1)
-                
-                # Update strength (simplified)
-                if abs(diff) > 0:
-                    strength = min(127, strength + 1)
-                else:
-                    strength = max(0, strength - 1)
-                
-                f_out.write(bytes([output]))
-        
-        # Clean up PCM file
-        if os.path.exists(pcm_file):
-            os.remove(pcm_file)
-        
-        return dfpwm_file
+        states = (dfpwm.INITIAL_STATE,) * len(CHANNELS)
+        while True:
+            block = process.stdout.read(PCM_BLOCK_SIZE)
+            if not block:
+                break
+            # Reads are always whole frames except possibly a truncated last one
+            block = block[:len(block) - len(block) % 4]
+            # Encoding runs in the process pool so it doesn't hold our GIL
+            encoded, states = cpu_call(dfpwm.encode_stereo, block, states)
+            _write_outputs(outputs, encoded, progress)
+        _write_outputs(outputs, [dfpwm.flush(state) for state in states], progress)
         
+        drainer.join()
+        stderr = b"".join(stderr_tail)
+        if feeder is not None:
+            feeder.join()
+        # A failed download explains more than ffmpeg dying of it; a broken pipe is ffmpeg's fault
+        if feed_errors and not isinstance(feed_errors[0], BrokenPipeError):
+            raise feed_errors[0]
+        if process.wait() != 0:
+            raise subprocess.CalledProcessError(process.returncode, cmd, stderr=stderr)
+        if feed_errors:
+            raise feed_errors[0]
+    finally:
+        for f_out in outputs:
+            f_out.close()
+        if process.poll() is None:
+            process.kill()
+            process.wait()
+        process.stdout.close()
+        drainer.join()
+        process.stderr.close()
+
+def _drain_stderr(process: subprocess.Popen, tail: deque):
+    """Drainer thread: read ffmpeg's stderr until it exits, keeping the last lines"""
+    for line in process.stderr:
+        tail.append(line)
+
+def _feed_ffmpeg(process: subprocess.Popen, source: AudioSource, errors: list):
+    """Feeder thread: stream source audio into ffmpeg's stdin, then close it"""
+    try:
+        source(process.stdin.write)
     except Exception as e:
-        print(f"DFPWM conversion error for {video_id}: {e}")
-        return None
+        errors.append(e)
+        # Stop ffmpeg so the encode loop doesn't publish a truncated track
+        process.kill()
+    finally:
+        try:
+            process.stdin.close()
+        except OSError:
+            pass
 
+def _write_outputs(outputs, encoded, progress):
+    """Write one encoded block per channel and report progress once all are flushed"""
+    for f_out, data in zip(outputs, encoded):
+        f_out.write(data)
+        f_out.flush()
+    if progress and encoded[0]:
+        progress(len(encoded[0]))
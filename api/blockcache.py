@@ -0,0 +1,131 @@
+import os
+import mmap
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+# In-memory cache for hot DFPWM data (set before starting the server)
+# AUDIO_CACHE_BYTES: total byte budget for cached blocks (0 disables the cache)
+# AUDIO_CACHE_BLOCK_SIZE: bytes per cached block
+# AUDIO_CACHE_MMAP: read misses through mmap instead of open/seek/read
+# AUDIO_CACHE_MAX_MAPS: files kept mapped at once (least recently used are unmapped)
+AUDIO_CACHE_BYTES = int(os.environ.get('AUDIO_CACHE_BYTES', str(64 * 1024 * 1024)))
+AUDIO_CACHE_BLOCK_SIZE = int(os.environ.get('AUDIO_CACHE_BLOCK_SIZE', str(64 * 1024)))
+AUDIO_CACHE_MMAP = os.environ.get('AUDIO_CACHE_MMAP', 'false').lower() == 'true'
+AUDIO_CACHE_MAX_MAPS = int(os.environ.get('AUDIO_CACHE_MAX_MAPS', '32'))
+
+BlockKey = Tuple[str, Optional[str], int]  # (video_id, channel, block index)
+
+class BlockCache:
+    """LRU cache of fixed-size blocks from completed DFPWM files, bounded by total bytes"""
+
+    def __init__(self, max_bytes: int, block_size: int, use_mmap: bool = False, max_maps: int = 32):
+        self.max_bytes = max_bytes
+        self.block_size = block_size
+        self.use_mmap = use_mmap
+        self.max_maps = max(1, max_maps)
+        self._blocks: "OrderedDict[BlockKey, bytes]" = OrderedDict()
+        # path -> (video_id, mapping), least recently used first
+        self._maps: "OrderedDict[str, Tuple[str, mmap.mmap]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def read(self, video_id: str, channel: Optional[str], path: str, offset: int, size: int) -> bytes:
+        """Read a byte range of a completed DFPWM file through the cache"""
+        if size <= 0:
+            return b""
+        first = offset // self.block_size
+        last = (offset + size - 1) // self.block_size
+        parts = []
+        for index in range(first, last + 1):
+            block = self._get_block(video_id, channel, path, index)
+            if not block:
+                break
+            start = offset - index * self.block_size if index == first else 0
+            end = min(len(block), offset + size - index * self.block_size)
+            # A fully covered block is returned as-is, without copying
+            parts.append(block if start == 0 and end == len(block) else block[start:end])
+            if len(block) < self.block_size:
+                break  # End of file
+        return parts[0] if len(parts) == 1 else b"".join(parts)
+
+    def _get_block(self, video_id: str, channel: Optional[str], path: str, index: int) -> bytes:
+        key = (video_id, channel, index)
+        with self._lock:
+            block = self._blocks.get(key)
+            if block is not None:
+                self._blocks.move_to_end(key)
+                self.hits += 1
+                return block
+            self.misses += 1
+
+        block = self._load_block(video_id, path, index)
+        if block and self.max_bytes > 0 and len(block) <= self.max_bytes:
+            with self._lock:
+                if key not in self._blocks:
+                    self._blocks[key] = block
+                    self._bytes += len(block)
+                    self._evict()
+        return block
+
+    def _load_block(self, video_id: str, path: str, index: int) -> bytes:
+        offset = index * self.block_size
+        if self.use_mmap:
+            # Slice under the lock so invalidate() can't close the mapping mid-read
+            with self._lock:
+                mapping = self._get_mmap(video_id, path)
+                if mapping is not None:
+                    return mapping[offset:offset + self.block_size]
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            return f.read(self.block_size)
+
+    def _get_mmap(self, video_id: str, path: str) -> Optional[mmap.mmap]:
+        """Map a completed file on first use, unmapping the least recently used beyond max_maps (lock held)"""
+        entry = self._maps.get(path)
+        if entry is not None:
+            self._maps.move_to_end(path)
+            return entry[1]
+        if os.path.getsize(path) == 0:
+            return None  # Empty files can't be mapped
+        with open(path, 'rb') as f:
+            mapping = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._maps[path] = (video_id, mapping)
+        while len(self._maps) > self.max_maps:
+            self._maps.popitem(last=False)[1][1].close()
+        return mapping
+
+    def _evict(self):
+        """Drop least recently used blocks until we're within budget (lock held)"""
+        while self._bytes > self.max_bytes and self._blocks:
+            _, block = self._blocks.popitem(last=False)
+            self._bytes -= len(block)
+            self.evictions += 1
+
+    def invalidate(self, video_id: str):
+        """Forget every cached block (and mapping) of a video, e.g. when its files change"""
+        with self._lock:
+            for key in [key for key in self._blocks if key[0] == video_id]:
+                self._bytes -= len(self._blocks.pop(key))
+            for path in [path for path, entry in self._maps.items() if entry[0] == video_id]:
+                self._maps.pop(path)[1].close()
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "blocks": len(self._blocks),
+                "bytes": self._bytes,
+                "maxBytes": self.max_bytes,
+                "blockSize": self.block_size,
+                "mmap": self.use_mmap,
+                "maps": len(self._maps),
+            }
+
+# Process-wide cache shared by all chunk requests
+block_cache = BlockCache(AUDIO_CACHE_BYTES, AUDIO_CACHE_BLOCK_SIZE, AUDIO_CACHE_MMAP, AUDIO_CACHE_MAX_MAPS)
@@ -0,0 +1,130 @@
+import os
+import json
+import threading
+from typing import Dict, Optional
+from yt_dlp import YoutubeDL
+
+AUTH_FILE = "headers_auth.json"
+AUDIO_CACHE_DIR = os.path.join("cache", "audio")
+
+# WARP proxy (Cloudflare WARP in proxy mode), read once at startup
+# Default WARP proxy is SOCKS5 on 127.0.0.1:40000
+WARP_PROXY = os.environ.get('WARP_PROXY', 'socks5://127.0.0.1:40000')
+USE_WARP = os.environ.get('USE_WARP', 'false').lower() == 'true'
+
+# Better user agent to avoid bot detection
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+# Additional options to reduce bot detection for cloud IPs
+YOUTUBE_EXTRACTOR_ARGS = {
+    'youtube': {
+        'player_client': ['android', 'ios', 'web'],  # Try multiple clients
+        'player_skip': ['webpage', 'configs'],  # Skip some checks
+    }
+}
+
+# Options per use; proxy and cookies are added by ydl_options()
+PROFILES: Dict[str, Dict] = {
+    # Full video info (metadata fallback)
+    'metadata': {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': False,
+        'user_agent': USER_AGENT,
+        'referer': 'https://www.youtube.com/',
+        'extractor_args': YOUTUBE_EXTRACTOR_ARGS,
+        'sleep_interval': 1,
+    },
+    # Native audio stream downloads, optimized for cloud/VPS environments
+    'audio': {
+        # Prefer opus over plain HTTP: it streams well and needs no remuxing
+        'format': 'bestaudio[acodec=opus][protocol^=http]/bestaudio[protocol^=http]/bestaudio/best',
+        'outtmpl': os.path.join(AUDIO_CACHE_DIR, '%(id)s.%(ext)s'),
+        'quiet': True,
+        'no_warnings': True,
+        'user_agent': USER_AGENT,
+        'referer': 'https://www.youtube.com/',
+        'extractor_args': YOUTUBE_EXTRACTOR_ARGS,
+        # Additional options for cloud environments
+        'sleep_interval': 1,  # Add small delay between requests
+        'sleep_interval_requests': 1,
+    },
+    # Flat listings (search results, playlists)
+    'flat': {
+        'quiet': True,
+        'no_warnings': True,
+        'extract_flat': True,  # Playlists are fetched a page at a time (see api/playlist.py)
+    },
+}
+
+_cookie: Optional[str] = None
+_cookie_mtime: Optional[float] = None
+_config_version = 0
+_config_lock = threading.Lock()
+_local = threading.local()
+
+def _reload_config():
+    """Re-read headers_auth.json if it changed since the last call"""
+    global _cookie, _cookie_mtime, _config_version
+    try:
+        mtime = os.path.getmtime(AUTH_FILE)
+    except OSError:
+        mtime = None
+
+    with _config_lock:
+        if mtime == _cookie_mtime and _config_version > 0:
+            return
+
+        cookie = None
+        if mtime is not None:
+            try:
+                with open(AUTH_FILE, 'r') as f:
+                    # yt-dlp needs cookies in Netscape format, but the cookie header works too
+                    cookie = json.load(f).get('cookie')
+            except Exception as e:
+                print(f"Warning: Failed to read {AUTH_FILE}: {e}")
+
+        _cookie = cookie
+        _cookie_mtime = mtime
+        _config_version += 1
+
+def get_cookie() -> Optional[str]:
+    """Cookie header from headers_auth.json, if any"""
+    _reload_config()
+    return _cookie
+
+def ydl_options(profile: str) -> Dict:
+    """Complete yt-dlp options for a profile (a fresh dict, safe to modify)"""
+    options = dict(PROFILES[profile])
+    if USE_WARP:
+        options['proxy'] = WARP_PROXY
+
+    # Add cookies via headers if we have them
+    cookie = get_cookie()
+    if cookie and profile != 'flat':
+        options['http_headers'] = {'Cookie': cookie}
+    return options
+
+def get_ydl(profile: str) -> YoutubeDL:
+    """
+    Warm YoutubeDL instance for a profile, reused by the calling thread.
+    YoutubeDL isn't thread-safe, so every thread gets its own; instances are
+    rebuilt when headers_auth.json changes.
+    """
+    _reload_config()
+    clients = getattr(_local, 'clients', None)
+    if clients is None:
+        clients = _local.clients = {}
+
+    entry = clients.get(profile)
+    if entry is not None and entry[0] == _config_version:
+        return entry[1]
+    if entry is not None:
+        entry[1].close()
+
+    ydl = YoutubeDL(ydl_options(profile))
+    clients[profile] = (_config_version, ydl)
+    return ydl
+
+if USE_WARP:
+    print(f"Using WARP proxy for yt-dlp: {WARP_PROXY}")
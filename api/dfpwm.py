@@ -0,0 +1,116 @@
+import os
+import sys
+from array import array
+from typing import List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, the pure-Python backend gives identical output
+    np = None
+
+# DFPWM1a parameters (matches cc.audio.dfpwm in CC:Tweaked)
+PREC = 10
+MIN_STRENGTH = 2 << (PREC - 8)
+
+# Encoder state: (charge, strength, previous_bit, pending_byte, pending_bits)
+EncoderState = Tuple[int, int, int, int, int]
+INITIAL_STATE: EncoderState = (0, 0, 0, 0, 0)
+
+def encode_levels(levels: List[int], state: EncoderState = INITIAL_STATE) -> Tuple[bytes, EncoderState]:
+    """
+    Run the DFPWM1a encoder over signed 8-bit levels.
+    Bits are packed 8 samples per byte, first sample in the least significant bit.
+    Returns: (encoded bytes, new state) - leftover bits are carried in the state.
+    """
+    charge, strength, previous_bit, byte, nbits = state
+    out = bytearray()
+    append = out.append
+    max_strength = (1 << PREC) - 1
+    rounding = 1 << (PREC - 1)
+
+    for level in levels:
+        bit = 1 if (level > charge or (level == charge and charge == 127)) else 0
+        target = 127 if bit else -128
+
+        next_charge = charge + ((strength * (target - charge) + rounding) >> PREC)
+        if next_charge == charge and next_charge != target:
+            next_charge += 1 if bit else -1
+
+        # Strength grows while the bit repeats and shrinks when it flips
+        if bit == previous_bit:
+            if strength != max_strength:
+                strength += 1
+        elif strength != 0:
+            strength -= 1
+        if strength < MIN_STRENGTH:
+            strength = MIN_STRENGTH
+
+        charge = next_charge
+        previous_bit = bit
+
+        byte = (byte >> 1) | (bit << 7)
+        nbits += 1
+        if nbits == 8:
+            append(byte)
+            byte = 0
+            nbits = 0
+
+    return bytes(out), (charge, strength, previous_bit, byte, nbits)
+
+def flush(state: EncoderState) -> bytes:
+    """Return the final partial byte (zero padded), if any"""
+    byte, nbits = state[3], state[4]
+    if nbits == 0:
+        return b""
+    return bytes([byte >> (8 - nbits)])
+
+def _stereo_levels_python(pcm: bytes) -> Tuple[List[int], List[int], List[int]]:
+    """Split interleaved 16-bit stereo PCM into mono, left and right 8-bit levels"""
+    samples = array('h')
+    samples.frombytes(pcm)
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    left = samples[0::2]
+    right = samples[1::2]
+    # Same gains as the old ffmpeg pan filters: 0.5*L+0.5*R, 0.5*L, 0.5*R
+    mono = [(l + r) >> 9 for l, r in zip(left, right)]
+    return mono, [l >> 9 for l in left], [r >> 9 for r in right]
+
+def _stereo_levels_numpy(pcm: bytes) -> Tuple[List[int], List[int], List[int]]:
+    """Split interleaved 16-bit stereo PCM into mono, left and right 8-bit levels using NumPy"""
+    frames = np.frombuffer(pcm, dtype='<i2').reshape(-1, 2).astype(np.int32)
+    left = frames[:, 0]
+    right = frames[:, 1]
+    return ((left + right) >> 9).tolist(), (left >> 9).tolist(), (right >> 9).tolist()
+
+STEREO_BACKENDS = {
+    'python': _stereo_levels_python,
+}
+if np is not None:
+    STEREO_BACKENDS['numpy'] = _stereo_levels_numpy
+
+def get_backend(name: Optional[str] = None) -> str:
+    """Pick an encoder backend (DFPWM_BACKEND env var, else NumPy when installed)"""
+    name = name or os.environ.get('DFPWM_BACKEND')
+    if name:
+        if name not in STEREO_BACKENDS:
+            raise ValueError(f"Unknown DFPWM backend: {name}")
+        return name
+    return 'numpy' if 'numpy' in STEREO_BACKENDS else 'python'
+
+def encode_stereo(pcm: bytes, states: Tuple[EncoderState, EncoderState, EncoderState],
+                  backend: Optional[str] = None) -> Tuple[Tuple[bytes, bytes, bytes], Tuple[EncoderState, EncoderState, EncoderState]]:
+    """
+    Encode a block of interleaved 16-bit stereo PCM (whole frames) into
+    mono, left and right DFPWM in one pass.
+    states: (mono, left, right) encoder states
+    Returns: ((mono, left, right) encoded bytes, new states)
+    """
+    levels = STEREO_BACKENDS[get_backend(backend)](pcm)
+    outputs = []
+    new_states = []
+    for channel_levels, state in zip(levels, states):
+        data, state = encode_levels(channel_levels, state)
+        outputs.append(data)
+        new_states.append(state)
+    return tuple(outputs), tuple(new_states)
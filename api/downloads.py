@@ -0,0 +1,237 @@
+import os
+import heapq
+import itertools
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+from api.audio import find_audio_file, is_dfpwm_complete, start_dfpwm_conversion
+from api.janitor import janitor, AUDIO
+
+# Number of concurrent downloads (set before starting the server)
+DOWNLOAD_WORKERS = int(os.environ.get('DOWNLOAD_WORKERS', '2'))
+# Pipe downloads straight into the DFPWM encoder instead of converting after the download
+STREAM_DOWNLOADS = os.environ.get('STREAM_DOWNLOADS', 'true').lower() == 'true'
+
+# Finished (ready/failed) jobs kept so /api/status can still report them
+FINISHED_JOB_HISTORY = 256
+
+# Lower runs first: the track being played beats prefetching
+PRIORITY_PLAYBACK = 0
+PRIORITY_PREFETCH = 10
+
+# Job states
+QUEUED = "queued"
+DOWNLOADING = "downloading"
+CONVERTING = "converting"
+READY = "ready"
+FAILED = "failed"
+
+class DownloadJob:
+    """Download + DFPWM conversion of one video"""
+
+    def __init__(self, video_id: str, priority: int):
+        self.video_id = video_id
+        self.priority = priority
+        self.status = QUEUED
+        self.error = None
+        self.downloaded = 0  # Source bytes received so far (streamed downloads)
+        self.background = False  # Running in one of the prefetch slots
+
+    def to_dict(self) -> Dict:
+        result = {"id": self.video_id, "status": self.status, "priority": self.priority}
+        if self.downloaded:
+            result["downloaded"] = self.downloaded
+        if self.error:
+            result["error"] = self.error
+        return result
+
+class DownloadScheduler:
+    """
+    Runs downloads on a fixed number of worker threads.
+    Each video_id has at most one job; scheduling it again only raises its priority.
+    Finished jobs are forgotten after FINISHED_JOB_HISTORY newer ones have finished.
+    Prefetches run on at most workers - 1 threads, so one worker is always
+    free for a track that is about to play (there's nothing to reserve with
+    a single worker).
+    """
+
+    def __init__(self, workers: int):
+        self.workers = max(1, workers)
+        self.prefetch_workers = max(1, self.workers - 1)
+        self._prefetching = 0
+        self._jobs: Dict[str, DownloadJob] = {}
+        self._queue: List[Tuple[int, int, str]] = []  # (priority, sequence, video_id)
+        self._sequence = itertools.count()
+        self._cond = threading.Condition()
+        self._threads: List[threading.Thread] = []
+        self._finished: deque = deque()  # Finished jobs, oldest first
+        self.cancelled = 0
+
+    def schedule(self, video_id: str, priority: int = PRIORITY_PLAYBACK) -> DownloadJob:
+        """Queue a video for download (deduplicated), or raise the priority of its queued job"""
+        with self._cond:
+            job = self._jobs.get(video_id)
+            if job is not None and job.status == FAILED:
+                job = None  # Try again
+            if job is not None and job.status == READY and not self._is_available(video_id):
+                job = None  # Files were removed since
+
+            if job is None:
+                job = DownloadJob(video_id, priority)
+                self._jobs[video_id] = job
+                self._push(job)
+            elif job.status == QUEUED and priority < job.priority:
+                # The old heap entry is skipped when popped because its priority no longer matches
+                job.priority = priority
+                self._push(job)
+
+            self._start_workers()
+            return job
+
+    def cancel(self, video_id: str, priority: int = PRIORITY_PREFETCH) -> bool:
+        """
+        Drop a job that is still queued at `priority` or lower (by default only prefetches).
+        Jobs already downloading or converting are left to finish.
+        """
+        with self._cond:
+            job = self._jobs.get(video_id)
+            if job is None or job.status != QUEUED or job.priority < priority:
+                return False
+            # Its heap entry is skipped when popped because the job is gone
+            del self._jobs[video_id]
+            self.cancelled += 1
+            return True
+
+    def get_job(self, video_id: str) -> Optional[DownloadJob]:
+        with self._cond:
+            return self._jobs.get(video_id)
+
+    def status(self, video_id: str) -> Dict:
+        """Status of a video's job, or of its cached files if it has no job"""
+        job = self.get_job(video_id)
+        if job is not None:
+            return job.to_dict()
+        return {"id": video_id, "status": READY if self._is_available(video_id) else "unknown"}
+
+    def stats(self) -> Dict:
+        with self._cond:
+            counts = {state: 0 for state in (QUEUED, DOWNLOADING, CONVERTING, READY, FAILED)}
+            for job in self._jobs.values():
+                counts[job.status] += 1
+            return {
+                "workers": self.workers,
+                "jobs": counts,
+                "prefetching": self._prefetching,
+                "cancelled": self.cancelled,
+            }
+
+    @staticmethod
+    def _is_available(video_id: str) -> bool:
+        return is_dfpwm_complete(video_id) or find_audio_file(video_id) is not None
+
+    def _push(self, job: DownloadJob):
+        heapq.heappush(self._queue, (job.priority, next(self._sequence), job.video_id))
+        self._cond.notify()
+
+    def _start_workers(self):
+        """Start worker threads on first use (lock held)"""
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._worker, name=f"download-{len(self._threads)}")
+            thread.daemon = True
+            thread.start()
+            self._threads.append(thread)
+
+    def _next_job(self) -> DownloadJob:
+        with self._cond:
+            while True:
+                job = self._peek()
+                if job is None or (job.priority >= PRIORITY_PREFETCH and self._prefetching >= self.prefetch_workers):
+                    # Nothing to do, or only prefetches while their slots are taken
+                    self._cond.wait()
+                    continue
+                heapq.heappop(self._queue)
+                job.status = DOWNLOADING
+                if job.priority >= PRIORITY_PREFETCH:
+                    job.background = True
+                    self._prefetching += 1
+                return job
+
+    def _peek(self) -> Optional[DownloadJob]:
+        """Job of the first valid queue entry, dropping stale ones (lock held)"""
+        while self._queue:
+            priority, _, video_id = self._queue[0]
+            job = self._jobs.get(video_id)
+            if job is not None and job.status == QUEUED and job.priority == priority:
+                return job
+            heapq.heappop(self._queue)
+        return None
+
+    def _worker(self):
+        while True:
+            job = self._next_job()
+            try:
+                self._run(job)
+                job.status = READY
+            except Exception as e:
+                job.error = str(e)
+                job.status = FAILED
+            self._job_finished(job)
+
+    def _run(self, job: DownloadJob):
+        # Imported here: api.process schedules downloads through this module
+        from api.process import ensure_audio_downloaded
+
+        if STREAM_DOWNLOADS and not find_audio_file(job.video_id):
+            # Download-while-encode: the first DFPWM bytes exist seconds after the download starts
+            conversion = start_dfpwm_conversion(job.video_id, self._stream_source(job))
+            if conversion is not None:
+                conversion.finished.wait()
+                if not conversion.error:
+                    return
+                # Fall back to a plain download (with retries) below
+                print(f"Streaming conversion failed for {job.video_id}, downloading instead: {conversion.error}")
+                job.status = DOWNLOADING
+                job.downloaded = 0
+
+        ensure_audio_downloaded(job.video_id)
+        if not find_audio_file(job.video_id):
+            raise Exception("Audio download failed")
+        janitor.refresh(AUDIO, job.video_id)
+
+        job.status = CONVERTING
+        conversion = start_dfpwm_conversion(job.video_id)
+        if conversion is not None:
+            conversion.finished.wait()
+            if conversion.error:
+                raise Exception(conversion.error)
+
+    @staticmethod
+    def _stream_source(job: DownloadJob):
+        """Audio source for a streamed conversion that keeps the job's status and progress up to date"""
+        from api.process import stream_audio_download
+
+        def source(write):
+            def counted(data: bytes):
+                write(data)
+                job.downloaded += len(data)
+
+            stream_audio_download(job.video_id, counted)
+            # Everything is received; the encoder finishes what ffmpeg still has
+            job.status = CONVERTING
+        return source
+
+    def _job_finished(self, job: DownloadJob):
+        """Free the job's prefetch slot and keep a bounded history of finished jobs"""
+        with self._cond:
+            if job.background:
+                job.background = False
+                self._prefetching -= 1
+                self._cond.notify_all()
+            self._finished.append(job)
+            while len(self._finished) > FINISHED_JOB_HISTORY:
+                old = self._finished.popleft()
+                if self._jobs.get(old.video_id) is old and old.status in (READY, FAILED):
+                    del self._jobs[old.video_id]
+
+# Process-wide scheduler used by /api/process
+download_scheduler = DownloadScheduler(DOWNLOAD_WORKERS)
@@ -0,0 +1,83 @@
+import os
+import asyncio
+import functools
+import multiprocessing
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional
+
+# Pool sizes (set before starting the server)
+# IO_WORKERS: threads for blocking network/subprocess calls
+# CPU_WORKERS: processes for DFPWM encoding (0 = encode in the calling thread)
+IO_WORKERS = int(os.environ.get('IO_WORKERS', '32'))
+CPU_WORKERS = int(os.environ.get('CPU_WORKERS', str(min(4, os.cpu_count() or 1))))
+
+_io_pool: Optional[ThreadPoolExecutor] = None
+_cpu_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def get_io_pool() -> ThreadPoolExecutor:
+    """Shared thread pool for blocking I/O (created on first use)"""
+    global _io_pool
+    with _pool_lock:
+        if _io_pool is None:
+            _io_pool = ThreadPoolExecutor(max_workers=IO_WORKERS, thread_name_prefix="io")
+        return _io_pool
+
+def get_cpu_pool() -> Optional[ProcessPoolExecutor]:
+    """Shared process pool for CPU-bound work, or None if CPU_WORKERS is 0"""
+    global _cpu_pool
+    if CPU_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _cpu_pool is None:
+            # spawn behaves the same on every platform and doesn't fork our threads
+            _cpu_pool = ProcessPoolExecutor(
+                max_workers=CPU_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _cpu_pool
+
+def _drop_cpu_pool(pool: ProcessPoolExecutor):
+    """Forget a broken process pool (a worker died) so the next call starts a new one"""
+    global _cpu_pool
+    with _pool_lock:
+        if _cpu_pool is pool:
+            _cpu_pool = None
+        else:
+            return
+    print("CPU worker process died, restarting the process pool")
+    pool.shutdown(wait=False, cancel_futures=True)
+
+async def run_io(func: Callable, *args, **kwargs) -> Any:
+    """Run a blocking call in the I/O thread pool without blocking the event loop"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_io_pool(), functools.partial(func, *args, **kwargs))
+
+def submit_io(func: Callable, *args, **kwargs) -> Future:
+    """Start a background job in the I/O thread pool"""
+    return get_io_pool().submit(func, *args, **kwargs)
+
+def cpu_call(func: Callable, *args) -> Any:
+    """Run a CPU-bound function in the process pool from a worker thread and wait for it"""
+    pool = get_cpu_pool()
+    if pool is None:
+        return func(*args)
+    try:
+        return pool.submit(func, *args).result()
+    except BrokenProcessPool:
+        # Retry once on a fresh pool
+        _drop_cpu_pool(pool)
+        return get_cpu_pool().submit(func, *args).result()
+
+def shutdown():
+    """Stop the pools (called on server shutdown)"""
+    global _io_pool, _cpu_pool
+    with _pool_lock:
+        if _io_pool is not None:
+            _io_pool.shutdown(wait=False, cancel_futures=True)
+            _io_pool = None
+        if _cpu_pool is not None:
+            _cpu_pool.shutdown(wait=False, cancel_futures=True)
+            _cpu_pool = None
@@ -0,0 +1,233 @@
+import os
+import time
+import threading
+from typing import Dict, List, Optional
+from api.blockcache import block_cache
+from api.store import store
+from api.thumbnails import purge_thumbnails
+
+# Disk quotas for downloaded/converted audio (set before starting the server)
+# AUDIO_DISK_QUOTA / DFPWM_DISK_QUOTA: bytes for cache/audio and cache/dfpwm (0 = unlimited)
+# CACHE_EVICTION_POLICY: "lru" (least recently used) or "lfu" (least frequently used)
+# CACHE_JANITOR_INTERVAL: seconds between eviction passes
+# CACHE_MIN_AGE: seconds after its last use a track is protected from eviction
+# CACHE_PURGE_INTERVAL: seconds between removals of expired cache store entries (see CACHE_MAX_AGES) and their thumbnails
+AUDIO_DISK_QUOTA = int(os.environ.get('AUDIO_DISK_QUOTA', str(2 * 1024 ** 3)))
+DFPWM_DISK_QUOTA = int(os.environ.get('DFPWM_DISK_QUOTA', str(2 * 1024 ** 3)))
+CACHE_EVICTION_POLICY = os.environ.get('CACHE_EVICTION_POLICY', 'lru').lower()
+CACHE_JANITOR_INTERVAL = float(os.environ.get('CACHE_JANITOR_INTERVAL', '60'))
+CACHE_MIN_AGE = float(os.environ.get('CACHE_MIN_AGE', '600'))
+CACHE_PURGE_INTERVAL = float(os.environ.get('CACHE_PURGE_INTERVAL', '3600'))
+
+AUDIO_CACHE_DIR = os.path.join("cache", "audio")
+DFPWM_CACHE_DIR = os.path.join("cache", "dfpwm")
+
+# Cache kinds: each video has one entry per kind (all its files of that kind together)
+AUDIO = "audio"
+DFPWM = "dfpwm"
+
+class CacheJanitor:
+    """
+    Keeps cache/audio and cache/dfpwm within their byte quotas, and
+    periodically purges expired entries from the cache store.
+    An in-memory index (video_id -> size, last access, access count) is built
+    by one directory scan at startup and kept up to date by touch()/refresh(),
+    so eviction passes never rescan the directories.
+    A video is never evicted while it's being downloaded or converted, or
+    within CACHE_MIN_AGE of its last use (which covers playback; a file that
+    is already open keeps streaming after it's unlinked, and on Windows the
+    delete fails and is retried on the next pass).
+    """
+
+    def __init__(self, quotas: Dict[str, int], policy: str = 'lru',
+                 interval: float = 60, min_age: float = 600):
+        if policy not in ('lru', 'lfu'):
+            raise ValueError(f"Unknown CACHE_EVICTION_POLICY: {policy}")
+        self.quotas = quotas
+        self.policy = policy
+        self.interval = interval
+        self.min_age = min_age
+        self._index: Dict[str, Dict[str, List]] = {kind: {} for kind in quotas}  # kind -> video_id -> [size, last access, hits]
+        self._lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        self.evictions = 0
+        self.evicted_bytes = 0
+
+    def touch(self, kind: str, video_id: str):
+        """Record a use of a video's cached files"""
+        with self._lock:
+            entry = self._index[kind].get(video_id)
+            if entry is not None:
+                entry[1] = time.time()
+                entry[2] += 1
+                return
+        self.refresh(kind, video_id)
+
+    def refresh(self, kind: str, video_id: str):
+        """Re-read a video's file sizes after they were written (or removed)"""
+        size = sum(os.path.getsize(path) for path in _files(kind, video_id))
+        with self._lock:
+            if size == 0:
+                self._index[kind].pop(video_id, None)
+                return
+            entry = self._index[kind].setdefault(video_id, [0, 0.0, 0])
+            entry[0] = size
+            entry[1] = time.time()
+            entry[2] += 1
+
+    def start(self):
+        """Start the background janitor thread (once)"""
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._run, name="cache-janitor")
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        self.scan()
+        last_purge = 0.0
+        while True:
+            try:
+                self.collect()
+            except Exception as e:
+                print(f"Cache janitor error: {e}")
+            if time.monotonic() - last_purge >= CACHE_PURGE_INTERVAL:
+                last_purge = time.monotonic()
+                try:
+                    removed = store.purge_expired()
+                    if removed:
+                        print(f"Purged {removed} expired cache entries")
+                    removed = purge_thumbnails()
+                    if removed:
+                        print(f"Removed {removed} expired thumbnails")
+                except Exception as e:
+                    print(f"Cache purge error: {e}")
+            time.sleep(self.interval)
+
+    def scan(self):
+        """Build the index from the cache directories (startup only)"""
+        index: Dict[str, Dict[str, List]] = {kind: {} for kind in self.quotas}
+        for kind in self.quotas:
+            directory = AUDIO_CACHE_DIR if kind == AUDIO else DFPWM_CACHE_DIR
+            if not os.path.isdir(directory):
+                continue
+            for item in os.scandir(directory):
+                video_id = _video_id(kind, item.name)
+                if video_id is None or not item.is_file():
+                    continue
+                stat = item.stat()
+                entry = index[kind].setdefault(video_id, [0, 0.0, 0])
+                entry[0] += stat.st_size
+                # Last access isn't known yet; the newest file time is the best guess
+                entry[1] = max(entry[1], stat.st_mtime)
+
+        with self._lock:
+            for kind, entries in index.items():
+                # Keep anything recorded while scanning
+                entries.update(self._index[kind])
+                self._index[kind] = entries
+
+    def collect(self):
+        """Evict least recently/frequently used videos until every kind is within quota"""
+        for kind, quota in self.quotas.items():
+            if quota <= 0:
+                continue
+            with self._lock:
+                total = sum(entry[0] for entry in self._index[kind].values())
+                if total <= quota:
+                    continue
+                if self.policy == 'lfu':
+                    order = sorted(self._index[kind].items(), key=lambda item: (item[1][2], item[1][1]))
+                else:
+                    order = sorted(self._index[kind].items(), key=lambda item: item[1][1])
+
+            for video_id, (size, last_access, _) in order:
+                if total <= quota:
+                    break
+                if self._in_use(video_id, last_access):
+                    continue
+                self._evict(kind, video_id)
+                total -= size
+
+    def _in_use(self, video_id: str, last_access: float) -> bool:
+        # Imported here: these modules record accesses through this one
+        from api.audio import get_conversion_job
+        from api.downloads import download_scheduler, FAILED, READY
+
+        if time.time() - last_access < self.min_age:
+            return True
+        job = get_conversion_job(video_id)
+        if job is not None and not job.finished.is_set():
+            return True
+        download = download_scheduler.get_job(video_id)
+        return download is not None and download.status not in (FAILED, READY)
+
+    def _evict(self, kind: str, video_id: str):
+        freed = 0
+        for path in _files(kind, video_id):
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+                freed += size
+            except OSError as e:
+                print(f"Warning: Failed to evict {path}: {e}")
+        if kind == DFPWM:
+            block_cache.invalidate(video_id)
+
+        with self._lock:
+            self._index[kind].pop(video_id, None)
+            self.evictions += 1
+            self.evicted_bytes += freed
+        print(f"Evicted {kind} cache for {video_id} ({freed} bytes)")
+
+    def stats(self) -> Dict:
+        with self._lock:
+            usage = {
+                kind: {
+                    "videos": len(entries),
+                    "bytes": sum(entry[0] for entry in entries.values()),
+                    "quota": self.quotas[kind],
+                }
+                for kind, entries in self._index.items()
+            }
+            return {
+                "policy": self.policy,
+                "usage": usage,
+                "evictions": self.evictions,
+                "evictedBytes": self.evicted_bytes,
+            }
+
+def _files(kind: str, video_id: str) -> List[str]:
+    """Existing cache files of a video"""
+    from api.audio import CHANNELS, find_audio_file, get_dfpwm_path
+
+    if kind == AUDIO:
+        path = find_audio_file(video_id)
+        return [path] if path else []
+    paths = [get_dfpwm_path(video_id, channel) for channel in CHANNELS]
+    return [path for path in paths if os.path.exists(path)]
+
+def _video_id(kind: str, name: str) -> Optional[str]:
+    """Video a cache file belongs to, or None for files the janitor leaves alone (e.g. .part)"""
+    from api.audio import AUDIO_EXTENSIONS
+
+    base, ext = os.path.splitext(name)
+    if kind == AUDIO:
+        return base if ext in AUDIO_EXTENSIONS else None
+    if ext != '.dfpwm':
+        return None
+    if len(base) == 11:
+        return base  # Mono file (video IDs may end in "_left" themselves)
+    for suffix in ('_left', '_right'):
+        if base.endswith(suffix):
+            return base[:-len(suffix)]
+    return base
+
+# Process-wide janitor, started with the server
+janitor = CacheJanitor(
+    {AUDIO: AUDIO_DISK_QUOTA, DFPWM: DFPWM_DISK_QUOTA},
+    CACHE_EVICTION_POLICY,
+    CACHE_JANITOR_INTERVAL,
+    CACHE_MIN_AGE,
+)
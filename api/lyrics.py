@@ -1,10 +1,7 @@
-import os
-import json
 from typing import List, Dict
-from api import get_ytmusic, rate_limit, is_bot_detection_error
-
-LYRICS_CACHE_DIR = os.path.join("cache", "lyrics")
-os.makedirs(LYRICS_CACHE_DIR, exist_ok=True)
+from api import is_bot_detection_error
+from api.songs import get_song_info
+from api.store import store
 
 async def get_lyrics(video_id: str) -> List[Dict]:
     """
@@ -12,16 +9,14 @@ async def get_lyrics(video_id: str) -> List[Dict]:
     Returns: List of {time: float, text: str}
     """
     # Check cache
-    cache_file = os.path.join(LYRICS_CACHE_DIR, f"{video_id}.json")
-    if os.path.exists(cache_file):
-        with open(cache_file, 'r', encoding='utf-8') as f:
-            return json.load(f)
+    cached_lyrics = store.get("lyrics", video_id)
+    if cached_lyrics is not None:
+        return cached_lyrics
     
     try:
         # Get lyrics from YTMusic
-        rate_limit()  # Add delay between requests
-        ytmusic = get_ytmusic()
-        song_info = ytmusic.get_song(video_id)
+        # Usually already fetched by /api/process for this track
+        song_info = await get_song_info(video_id)
         
         if not song_info or 'lyrics' not in song_info or not song_info['lyrics']:
             return []
@@ -69,8 +64,7 @@ async def get_lyrics(video_id: str) -> List[Dict]:
                             })
         
         # Cache lyrics
-        with open(cache_file, 'w', encoding='utf-8') as f:
-            json.dump(formatted_lyrics, f, ensure_ascii=False)
+        store.put("lyrics", video_id, formatted_lyrics)
         
         return formatted_lyrics
         
@@ -0,0 +1,129 @@
+from typing import List, Tuple
+from PIL import Image
+
+try:
+    import numpy as np
+except ImportError:  # NumPy is optional, the pure-Python path gives the same colors
+    np = None
+
+# CC:Tweaked's default palette, indexed by term.blit color code (0 = white ... f = black)
+PALETTE: List[Tuple[int, int, int]] = [
+    (240, 240, 240),  # 0 white
+    (242, 178, 51),   # 1 orange
+    (229, 127, 216),  # 2 magenta
+    (153, 178, 242),  # 3 lightBlue
+    (222, 222, 108),  # 4 yellow
+    (127, 204, 25),   # 5 lime
+    (242, 178, 204),  # 6 pink
+    (76, 76, 76),     # 7 gray
+    (153, 153, 153),  # 8 lightGray
+    (76, 153, 178),   # 9 cyan
+    (178, 102, 229),  # a purple
+    (51, 102, 204),   # b blue
+    (127, 102, 76),   # c brown
+    (87, 166, 78),    # d green
+    (204, 76, 76),    # e red
+    (17, 17, 17),     # f black
+]
+BLIT_CHARS = "0123456789abcdef"
+WHITE = 0
+BLACK = 15
+
+# Nearest colors are precomputed for 32 levels per channel (exact except
+# for colors almost halfway between two palette entries)
+LUT_SHIFT = 3
+LUT_LEVELS = 256 >> LUT_SHIFT
+
+_lut = None
+
+def nearest_color(r: float, g: float, b: float) -> int:
+    """Index of the palette color closest to an RGB value"""
+    best = 0
+    best_dist = float('inf')
+    for index, (cr, cg, cb) in enumerate(PALETTE):
+        dist = (r - cr) ** 2 + (g - cg) ** 2 + (b - cb) ** 2
+        if dist < best_dist:
+            best_dist = dist
+            best = index
+    return best
+
+def _get_lut():
+    """Nearest palette index for every (r >> 3, g >> 3, b >> 3), built on first use"""
+    global _lut
+    if _lut is None:
+        centers = [(level << LUT_SHIFT) + (1 << (LUT_SHIFT - 1)) for level in range(LUT_LEVELS)]
+        if np is not None:
+            grid = np.array(centers, dtype=np.int32)
+            rgb = np.stack(np.meshgrid(grid, grid, grid, indexing='ij'), axis=-1)
+            palette = np.array(PALETTE, dtype=np.int32)
+            dist = ((rgb[:, :, :, None, :] - palette) ** 2).sum(axis=-1)
+            _lut = dist.argmin(axis=-1).astype(np.uint8)
+        else:
+            _lut = bytes(nearest_color(r, g, b) for r in centers for g in centers for b in centers)
+    return _lut
+
+def _lookup(lut, r: int, g: int, b: int) -> int:
+    r, g, b = r >> LUT_SHIFT, g >> LUT_SHIFT, b >> LUT_SHIFT
+    if np is not None:
+        return int(lut[r, g, b])
+    return lut[(r * LUT_LEVELS + g) * LUT_LEVELS + b]
+
+def quantize(img: Image.Image, dither: bool = False) -> List[List[int]]:
+    """
+    Map every pixel of an RGB image to the nearest palette color.
+    dither: spread the color error with Floyd-Steinberg dithering.
+    Returns: rows of palette indexes
+    """
+    if dither:
+        return _quantize_dithered(img)
+
+    lut = _get_lut()
+    if np is not None:
+        pixels = np.asarray(img, dtype=np.uint8) >> LUT_SHIFT
+        return lut[pixels[:, :, 0], pixels[:, :, 1], pixels[:, :, 2]].tolist()
+
+    width, height = img.size
+    data = list(img.getdata())
+    return [[_lookup(lut, *data[y * width + x]) for x in range(width)] for y in range(height)]
+
+def _quantize_dithered(img: Image.Image) -> List[List[int]]:
+    """Floyd-Steinberg dithering (sequential by nature, so one plain loop for both paths)"""
+    lut = _get_lut()
+    width, height = img.size
+    data = list(img.getdata())
+    # Working copy with the error carried so far
+    rows = [[list(data[y * width + x]) for x in range(width)] for y in range(height)]
+    result = []
+
+    for y in range(height):
+        row = rows[y]
+        below = rows[y + 1] if y + 1 < height else None
+        out = []
+        for x in range(width):
+            pixel = row[x]
+            clamped = [min(255, max(0, int(round(c)))) for c in pixel]
+            index = _lookup(lut, *clamped)
+            out.append(index)
+
+            target = PALETTE[index]
+            error = [pixel[c] - target[c] for c in range(3)]
+            for dx, dy, weight in ((1, 0, 7 / 16), (-1, 1, 3 / 16), (0, 1, 5 / 16), (1, 1, 1 / 16)):
+                nx = x + dx
+                if nx < 0 or nx >= width:
+                    continue
+                neighbour = row[nx] if dy == 0 else (below[nx] if below is not None else None)
+                if neighbour is None:
+                    continue
+                for c in range(3):
+                    neighbour[c] += error[c] * weight
+        result.append(out)
+
+    return result
+
+def brightness(img: Image.Image) -> List[List[float]]:
+    """Average of R, G and B (0-255) for every pixel"""
+    if np is not None:
+        return np.asarray(img, dtype=np.float32).mean(axis=-1).tolist()
+    width, height = img.size
+    data = list(img.getdata())
+    return [[sum(data[y * width + x]) / 3.0 for x in range(width)] for y in range(height)]
@@ -1,42 +1,55 @@
-from typing import Dict, List
-import re
+import os
 import time
-from api import get_ytmusic, rate_limit, is_bot_detection_error
+import asyncio
+import itertools
+from typing import Dict, List, Optional
+from api import call_ytmusic, rate_limit, is_bot_detection_error
+from api.cache import TTLCache
+from api.executor import run_io, submit_io
+from api.clients import get_ydl
+from api.store import store
 
-async def get_playlist(playlist_id: str) -> Dict:
+# PLAYLIST_CACHE_TTL: seconds a cached playlist is served before it's refreshed in the background
+# PLAYLIST_PAGE_SIZE: tracks fetched by the first request for a playlist (yt-dlp loads store progress as often)
+PLAYLIST_CACHE_TTL = float(os.environ.get('PLAYLIST_CACHE_TTL', '3600'))
+PLAYLIST_PAGE_SIZE = int(os.environ.get('PLAYLIST_PAGE_SIZE', '100'))
+
+# Concurrent first requests for a playlist share one fetch
+_first_pages = TTLCache(10, max_entries=64)
+
+# Background loads/refreshes, at most one per playlist
+_loads: Dict[str, asyncio.Task] = {}
+# yt-dlp walks in progress: playlist -> future of the final record
+_ytdlp_walks: Dict[str, asyncio.Future] = {}
+
+async def get_playlist(playlist_id: str, offset: int = 0, limit: Optional[int] = None) -> Dict:
     """
-    Get playlist tracks.
-    Returns: {title: str, tracks: [{id, title}]} or {error: str}
+    Get playlist tracks (tracks[offset:offset + limit], or all from offset without a limit).
+    The first request fetches one page and the rest is loaded in the background,
+    so a request for the first page returns right away; requests reaching past
+    what's loaded wait for it. Cached playlists are refreshed after PLAYLIST_CACHE_TTL.
+    Returns: {title: str, tracks: [{id, title}], offset: int, total: int|None, complete: bool} or {error: str}
     """
     try:
-        # Clean playlist ID (remove PL prefix if present in some formats)
-        clean_id = playlist_id
-        
-        # Try to get playlist from YTMusic
-        try:
-            rate_limit()  # Add delay between requests
-            ytmusic = get_ytmusic()
-            playlist = ytmusic.get_playlist(playlist_id, limit=None)
-            
-            if not playlist or 'tracks' not in playlist:
+        task = None
+        entry = store.get_entry("playlists", playlist_id)
+        if entry is None:
+            record = await _first_pages.get_or_load(playlist_id, lambda: _fetch_first_page(playlist_id))
+            if record is None:
                 return {"error": "Playlist not found"}
-            
-            tracks = []
-            for track in playlist['tracks']:
-                if 'videoId' in track:
-                    tracks.append({
-                        "id": track['videoId'],
-                        "title": track.get('title', 'Unknown')
-                    })
-            
-            return {
-                "title": playlist.get('title', 'Playlist'),
-                "tracks": tracks
-            }
-        except Exception as e:
-            # If YTMusic fails, try yt-dlp
-            return await get_playlist_ytdlp(playlist_id)
-            
+            if not record["complete"]:
+                task = _start_load(playlist_id)
+        else:
+            record, updated = entry
+            if not record["complete"] or time.time() - updated > PLAYLIST_CACHE_TTL:
+                task = _start_load(playlist_id)
+
+        loaded = len(record["tracks"])
+        if task is not None and not record["complete"] and (limit is None or offset + limit > loaded):
+            # Shielded: the load continues for other clients if this request goes away
+            record = await asyncio.shield(task) or record
+
+        return _page(record, offset, limit)
     except Exception as e:
         if is_bot_detection_error(e):
             print(f"Bot detection error: {e}")
@@ -46,45 +59,201 @@ async def get_playlist(playlist_id: str) -> Dict:
             print(f"Playlist error for {playlist_id}: {e}")
             return {"error": str(e)}
 
-async def get_playlist_ytdlp(playlist_id: str) -> Dict:
-    """Fallback: Get playlist using yt-dlp"""
+def _page(record: Dict, offset: int, limit: Optional[int]) -> Dict:
+    tracks = record["tracks"]
+    end = len(tracks) if limit is None else offset + limit
+    return {
+        "title": record["title"],
+        "tracks": tracks[offset:end],
+        "offset": offset,
+        # While loading, the count reported by YouTube (if any)
+        "total": len(tracks) if record["complete"] else record.get("trackCount"),
+        "complete": record["complete"],
+    }
+
+def _start_load(playlist_id: str) -> asyncio.Task:
+    """Background task completing or refreshing a cached playlist (one per playlist)"""
+    task = _loads.get(playlist_id)
+    if task is None or task.done():
+        task = asyncio.create_task(_load(playlist_id))
+        _loads[playlist_id] = task
+        task.add_done_callback(lambda done: _loads.pop(playlist_id, None) if _loads.get(playlist_id) is done else None)
+    return task
+
+async def _load(playlist_id: str) -> Optional[Dict]:
+    """Fetch what's missing or stale of a cached playlist; returns the stored record"""
+    entry = store.get_entry("playlists", playlist_id)
+    record = entry[0] if entry is not None else None
     try:
-        from yt_dlp import YoutubeDL
-        import os
-        
-        # Check for WARP proxy
-        warp_proxy = os.environ.get('WARP_PROXY', 'socks5://127.0.0.1:40000')
-        use_warp = os.environ.get('USE_WARP', 'false').lower() == 'true'
-        
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,
-            'playlistend': 200,  # Limit to 200 tracks
-            'proxy': warp_proxy if use_warp else None,
-        }
-        ydl_opts = {k: v for k, v in ydl_opts.items() if v is not None}
-        
-        url = f"https://www.youtube.com/playlist?list={playlist_id}"
-        
-        with YoutubeDL(ydl_opts) as ydl:
-            info = ydl.extract_info(url, download=False)
-            
-            if not info or 'entries' not in info:
-                return {"error": "Playlist not found"}
-            
-            tracks = []
-            for entry in info['entries']:
-                if entry and 'id' in entry:
-                    tracks.append({
-                        "id": entry['id'],
-                        "title": entry.get('title', 'Unknown')
-                    })
-            
-            return {
-                "title": info.get('title', 'Playlist'),
-                "tracks": tracks
-            }
+        if record is None:
+            # Purged since it was requested: start over
+            record = await _fetch_first_page(playlist_id)
+        elif record["complete"]:
+            if time.time() - entry[1] <= PLAYLIST_CACHE_TTL:
+                return record  # Completed by a walk that was already running
+            # Stale: the first page tells whether the playlist changed.
+            # The complete record is served until a changed playlist is fully loaded again
+            first = await _fetch_first_page(playlist_id, previous=record)
+            if first is None:
+                return record
+            if not first["complete"] and _unchanged(record, first):
+                store.put("playlists", playlist_id, record)
+                return record
+            if first["source"] == "ytmusic":
+                store.put("playlists", playlist_id, first)
+            record = first
+
+        if record is not None and not record["complete"]:
+            record = await _fetch_rest(playlist_id, record)
+    except Exception as e:
+        print(f"Playlist load error for {playlist_id}: {e}")
+    return record
+
+def _unchanged(record: Dict, first: Dict) -> bool:
+    """Same source, same track count and the same tracks on the first page"""
+    if first["source"] != record["source"] or first["trackCount"] is None:
+        return False
+    if first["trackCount"] != record["trackCount"]:
+        return False
+    ids = [track["id"] for track in first["tracks"]]
+    return ids == [track["id"] for track in record["tracks"][:len(ids)]]
+
+async def _fetch_first_page(playlist_id: str, previous: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    First PLAYLIST_PAGE_SIZE tracks from YTMusic (or yt-dlp), or None if not found.
+    previous: the stored record when refreshing it; the page isn't stored over it
+    """
+    try:
+        await rate_limit()  # Add delay between requests
+        playlist = await run_io(call_ytmusic, "get_playlist", playlist_id, limit=PLAYLIST_PAGE_SIZE)
     except Exception as e:
-        return {"error": str(e)}
+        # If YTMusic fails, try yt-dlp
+        return await get_playlist_ytdlp(playlist_id, previous=previous)
+
+    if not playlist or 'tracks' not in playlist:
+        return None
+    record = _ytmusic_record(playlist, PLAYLIST_PAGE_SIZE)
+    if previous is None:
+        store.put("playlists", playlist_id, record)
+    return record
+
+async def _fetch_rest(playlist_id: str, record: Dict) -> Dict:
+    """Complete a partly loaded playlist, storing it as it grows"""
+    if record["source"] == "ytmusic":
+        # ytmusicapi can't start at an offset, so the rest comes with the whole playlist
+        await rate_limit()
+        playlist = await run_io(call_ytmusic, "get_playlist", playlist_id, limit=None)
+        if playlist and 'tracks' in playlist:
+            record = _ytmusic_record(playlist, None)
+            store.put("playlists", playlist_id, record)
+        return record
+
+    walk = _ytdlp_walks.get(playlist_id)
+    if walk is None:
+        stored = store.get("playlists", playlist_id)
+        if stored is not None and stored["complete"]:
+            return stored  # The walk finished meanwhile
+        # No walk running (e.g. after a restart): continue after the entries already cached
+        await get_playlist_ytdlp(playlist_id, record)
+        walk = _ytdlp_walks.get(playlist_id)
+    if walk is None:
+        return store.get("playlists", playlist_id) or record
+    return await asyncio.shield(walk) or record
+
+def _tracks(entries: List[Dict], id_key: str) -> List[Dict]:
+    return [
+        {"id": entry[id_key], "title": entry.get('title', 'Unknown')}
+        for entry in entries
+        if entry and entry.get(id_key)
+    ]
+
+def _ytmusic_record(playlist: Dict, limit: Optional[int]) -> Dict:
+    entries = playlist['tracks']
+    count = playlist.get('trackCount')
+    return {
+        "title": playlist.get('title', 'Playlist'),
+        "tracks": _tracks(entries, 'videoId'),
+        "trackCount": count,
+        "fetched": len(entries),
+        "complete": limit is None or len(entries) < limit or (count is not None and len(entries) >= count),
+        "source": "ytmusic",
+    }
+
+async def get_playlist_ytdlp(playlist_id: str, record: Optional[Dict] = None,
+                             previous: Optional[Dict] = None) -> Optional[Dict]:
+    """
+    Fallback: Get playlist using yt-dlp, continuing after record's entries if given.
+    The playlist is walked once, lazily (each YouTube page is requested once), and
+    the record is stored every PLAYLIST_PAGE_SIZE entries. Returns as soon as the
+    first new page is stored (None if the playlist wasn't found); the walk goes on
+    in the background.
+    previous: the complete record when refreshing it. It stays stored until the walk
+    completes, and the walk stops after the first page if that shows no change.
+    """
+    loop = asyncio.get_running_loop()
+    first = loop.create_future()
+    done = loop.create_future()
+    for future in (first, done):
+        # Nobody may be waiting for it when the walk fails
+        future.add_done_callback(lambda settled: settled.cancelled() or settled.exception())
+
+    def settle(future: asyncio.Future, result=None, error: Optional[Exception] = None):
+        def apply():
+            if future.done():
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(result)
+        loop.call_soon_threadsafe(apply)
+
+    def walk():
+        try:
+            result = _walk_ytdlp(playlist_id, record, previous, lambda page: settle(first, page))
+            settle(first, result)
+            settle(done, result)
+        except Exception as e:
+            settle(first, error=e)
+            settle(done, error=e)
+
+    await rate_limit("ytdlp")
+    _ytdlp_walks[playlist_id] = done
+    done.add_done_callback(lambda settled: _ytdlp_walks.pop(playlist_id, None) if _ytdlp_walks.get(playlist_id) is settled else None)
+    # Not run_io: the walk outlives this call, and its YoutubeDL instance stays on one thread
+    submit_io(walk)
+    return await asyncio.shield(first)
+
+def _walk_ytdlp(playlist_id: str, record: Optional[Dict], previous: Optional[Dict], on_page) -> Optional[Dict]:
+    """
+    Blocking yt-dlp walk over a playlist; calls on_page(record) after each page.
+    Returns the final record, or previous if the walk stopped early because nothing changed.
+    """
+    url = f"https://www.youtube.com/playlist?list={playlist_id}"
+    # process=False keeps the entries a lazy generator that requests pages as it goes
+    info = get_ydl('flat').extract_info(url, download=False, process=False)
+    if not info or 'entries' not in info:
+        return None
+
+    skip = record["fetched"] if record else 0
+    current = {
+        "title": info.get('title', 'Playlist'),
+        "tracks": list(record["tracks"]) if record else [],
+        "trackCount": info.get('playlist_count'),
+        "fetched": skip,
+        "complete": False,
+        "source": "ytdlp",
+    }
+    for entry in itertools.islice(info['entries'], skip, None):
+        current["fetched"] += 1
+        current["tracks"].extend(_tracks([entry], 'id'))
+        if (current["fetched"] - skip) % PLAYLIST_PAGE_SIZE == 0:
+            page = dict(current, tracks=list(current["tracks"]))
+            if previous is None:
+                store.put("playlists", playlist_id, page)
+            on_page(page)
+            if previous is not None and _unchanged(previous, page):
+                return previous
 
+    current["complete"] = True
+    store.put("playlists", playlist_id, current)
+    return current
@@ -0,0 +1,116 @@
+import os
+import time
+import asyncio
+from typing import Dict, List, Optional
+from api.downloads import download_scheduler, PRIORITY_PREFETCH
+from api.process import process_video
+from api.store import store
+
+# Tracks after the one playing whose metadata, audio and DFPWM are prepared ahead (0 disables prefetching)
+PREFETCH_TRACKS = int(os.environ.get('PREFETCH_TRACKS', '3'))
+# Clients that sent no hint for this long are forgotten (seconds)
+PREFETCH_CLIENT_TTL = float(os.environ.get('PREFETCH_CLIENT_TTL', '3600'))
+
+class Prefetcher:
+    """
+    Prepares the next tracks of every client's queue at prefetch priority,
+    so they're ready by the time the current track ends.
+    Each client has one window of upcoming tracks; a new hint replaces it,
+    and queued prefetches that dropped out of every window (the user skipped
+    or started something else) are cancelled. Downloads already running
+    finish, but the scheduler keeps a worker free for the track that plays.
+    Clients silent for client_ttl seconds are forgotten.
+    """
+
+    def __init__(self, tracks: int, client_ttl: float = 3600):
+        self.tracks = tracks
+        self.client_ttl = client_ttl
+        self._windows: Dict[str, List[str]] = {}  # client -> upcoming video IDs
+        self._seen: Dict[str, float] = {}  # client -> time of its last hint
+        self._tasks: Dict[str, asyncio.Task] = {}
+        self.prefetched = 0
+
+    def now_playing(self, client: str, video_id: str, upcoming: List[str]) -> List[str]:
+        """Record what a client plays now and next; returns the video IDs being prefetched"""
+        window = []
+        for next_id in upcoming:
+            if len(window) >= self.tracks:
+                break
+            if next_id != video_id and next_id not in window:
+                window.append(next_id)
+
+        dropped = list(self._windows.get(client, []))
+        for idle in self._idle_clients():
+            dropped.extend(self._forget(idle))
+        self._windows[client] = window
+        self._seen[client] = time.monotonic()
+
+        task = self._tasks.pop(client, None)
+        if task is not None:
+            task.cancel()
+
+        wanted = {video_id}
+        for other in self._windows.values():
+            wanted.update(other)
+        for old_id in dropped:
+            if old_id not in wanted:
+                download_scheduler.cancel(old_id)
+
+        if window:
+            task = asyncio.create_task(self._warm(window))
+            self._tasks[client] = task
+            task.add_done_callback(lambda done: self._tasks.pop(client, None) if self._tasks.get(client) is done else None)
+        return window
+
+    def _idle_clients(self) -> List[str]:
+        cutoff = time.monotonic() - self.client_ttl
+        return [client for client, seen in self._seen.items() if seen < cutoff]
+
+    def _forget(self, client: str) -> List[str]:
+        """Drop a client, returning its window"""
+        self._seen.pop(client, None)
+        task = self._tasks.pop(client, None)
+        if task is not None:
+            task.cancel()
+        return self._windows.pop(client, [])
+
+    async def _warm(self, window: List[str]):
+        # One track at a time: metadata requests share the rate limit with interactive ones
+        for video_id in window:
+            try:
+                await process_video(video_id, PRIORITY_PREFETCH)
+                self.prefetched += 1
+            except Exception as e:
+                print(f"Prefetch error for {video_id}: {e}")
+
+    def stats(self) -> Dict:
+        return {
+            "tracks": self.tracks,
+            "clients": len(self._windows),
+            "prefetched": self.prefetched,
+            "cancelled": download_scheduler.cancelled,
+        }
+
+def upcoming_tracks(video_id: str, playlist_id: Optional[str] = None, queue: Optional[List[str]] = None) -> List[str]:
+    """
+    Video IDs after video_id: from the client's queue if given, else from the
+    cached playlist. A queue that doesn't contain video_id is taken as the upcoming tracks.
+    """
+    if queue:
+        ids = queue
+    elif playlist_id:
+        record = store.get("playlists", playlist_id)
+        if record is None:
+            return []
+        ids = [track["id"] for track in record["tracks"]]
+        if video_id not in ids:
+            return []
+    else:
+        return []
+
+    if video_id in ids:
+        ids = ids[ids.index(video_id) + 1:]
+    return ids
+
+# Process-wide prefetcher used by /api/playlist and /api/nowplaying
+prefetcher = Prefetcher(PREFETCH_TRACKS, PREFETCH_CLIENT_TTL)
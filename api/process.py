@@ -1,22 +1,27 @@
-from yt_dlp import YoutubeDL
 import os
-import json
 import re
-from typing import Dict, Optional
-from api import get_ytmusic, rate_limit, is_bot_detection_error
+from typing import Callable, Dict, Optional
+from api import rate_limit, rate_limit_sync, is_bot_detection_error
+from api.songs import get_song_info
+from api.executor import run_io
+from api.clients import get_ydl
+from api.downloads import download_scheduler, PRIORITY_PLAYBACK
+from api.audio import find_audio_file
+from api.store import store
 
 # Cache directory
 CACHE_DIR = "cache"
 AUDIO_CACHE_DIR = os.path.join(CACHE_DIR, "audio")
-METADATA_CACHE_DIR = os.path.join(CACHE_DIR, "metadata")
 
 os.makedirs(AUDIO_CACHE_DIR, exist_ok=True)
-os.makedirs(METADATA_CACHE_DIR, exist_ok=True)
 
-async def process_video(video_id_or_url: str) -> Dict:
+# Read size when streaming audio into the DFPWM pipeline
+STREAM_READ_SIZE = 64 * 1024
+
+async def process_video(video_id_or_url: str, priority: int = PRIORITY_PLAYBACK) -> Dict:
     """
     Process a video ID or URL and return metadata.
-    Downloads audio if not cached.
+    Downloads audio if not cached, at the given download priority.
     Returns: {id, title, artist, album?, duration, hasLyrics}
     """
     # Extract video ID
@@ -25,13 +30,11 @@ async def process_video(video_id_or_url: str) -> Dict:
         return {"error": "Invalid video ID or URL"}
     
     # Check metadata cache
-    metadata_file = os.path.join(METADATA_CACHE_DIR, f"{video_id}.json")
-    if os.path.exists(metadata_file):
-        with open(metadata_file, 'r', encoding='utf-8') as f:
-            cached_metadata = json.load(f)
-            # Still ensure audio is downloaded
-            await ensure_audio_downloaded(video_id)
-            return cached_metadata
+    cached_metadata = store.get("metadata", video_id)
+    if cached_metadata is not None:
+        # Still ensure audio is downloaded (in the background)
+        download_scheduler.schedule(video_id, priority)
+        return cached_metadata
     
     # Try to get metadata from YTMusic first (works with OAuth)
     title = None
@@ -41,9 +44,7 @@ async def process_video(video_id_or_url: str) -> Dict:
     has_lyrics = False
     
     try:
-        rate_limit()
-        ytmusic = get_ytmusic()
-        song_info = ytmusic.get_song(video_id)
+        song_info = await get_song_info(video_id)
         
         if song_info and 'videoDetails' in song_info:
             vd = song_info['videoDetails']
@@ -74,60 +75,26 @@ async def process_video(video_id_or_url: str) -> Dict:
     if not title:
         try:
             # Get video info using yt-dlp as fallback
-            # Check for cookies to help with bot detection
-            cookie_string_meta = None
-            if os.path.exists("headers_auth.json"):
-                try:
-                    with open("headers_auth.json", 'r') as f:
-                        headers_data = json.load(f)
-                        if 'cookie' in headers_data:
-                            cookie_string_meta = headers_data['cookie']
-                except:
-                    pass
+            def extract():
+                url = f"https://www.youtube.com/watch?v={video_id}"
+                return get_ydl('metadata').extract_info(url, download=False)
             
-            # Check for WARP proxy
-            warp_proxy_meta = os.environ.get('WARP_PROXY', 'socks5://127.0.0.1:40000')
-            use_warp_meta = os.environ.get('USE_WARP', 'false').lower() == 'true'
+            await rate_limit("ytdlp")
+            info = await run_io(extract)
             
-            ydl_opts = {
-                'quiet': True,
-                'no_warnings': True,
-                'extract_flat': False,
-                'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'referer': 'https://www.youtube.com/',
-                'proxy': warp_proxy_meta if use_warp_meta else None,
-                'extractor_args': {
-                    'youtube': {
-                        'player_client': ['android', 'ios', 'web'],
-                        'player_skip': ['webpage', 'configs'],
-                    }
-                },
-                'http_headers': {
-                    'Cookie': cookie_string_meta
-                } if cookie_string_meta else None,
-                'sleep_interval': 1,
-            }
-            ydl_opts = {k: v for k, v in ydl_opts.items() if v is not None}
-            if not cookie_string_meta:
-                ydl_opts.pop('http_headers', None)
+            if not title:
+                title = info.get('title', 'Unknown')
+            if not duration:
+                duration = info.get('duration', 0)
             
-            with YoutubeDL(ydl_opts) as ydl:
-                url = f"https://www.youtube.com/watch?v={video_id}"
-                info = ydl.extract_info(url, download=False)
-                
-                if not title:
-                    title = info.get('title', 'Unknown')
-                if not duration:
-                    duration = info.get('duration', 0)
-                
-                # Use yt-dlp metadata if YTMusic didn't provide it
-                if artist == "Unknown Artist":
-                    if 'artist' in info:
-                        artist = info['artist']
-                    elif 'uploader' in info:
-                        artist = info['uploader']
-                if not album and 'album' in info:
-                    album = info['album']
+            # Use yt-dlp metadata if YTMusic didn't provide it
+            if artist == "Unknown Artist":
+                if 'artist' in info:
+                    artist = info['artist']
+                elif 'uploader' in info:
+                    artist = info['uploader']
+            if not album and 'album' in info:
+                album = info['album']
                     
         except Exception as e:
             error_msg = str(e).lower()
@@ -157,17 +124,13 @@ async def process_video(video_id_or_url: str) -> Dict:
     
     # Cache metadata
     try:
-        with open(metadata_file, 'w', encoding='utf-8') as f:
-            json.dump(metadata, f, ensure_ascii=False)
+        store.put("metadata", video_id, metadata)
     except Exception as e:
         print(f"Warning: Failed to cache metadata: {e}")
     
     # Download audio (this may take a while, but we need it for playback)
     # Start download in background - it will be ready when needed
-    import threading
-    thread = threading.Thread(target=ensure_audio_downloaded, args=(video_id,))
-    thread.daemon = True
-    thread.start()
+    download_scheduler.schedule(video_id, priority)
     
     return metadata
 
@@ -191,87 +154,25 @@ def extract_video_id(video_id_or_url: str) -> Optional[str]:
     return None
 
 def ensure_audio_downloaded(video_id: str):
-    """Download audio file if not already cached"""
-    audio_file = os.path.join(AUDIO_CACHE_DIR, f"{video_id}.m4a")
-    if os.path.exists(audio_file):
+    """
+    Download audio file if not already cached.
+    The native stream (opus/webm or m4a) is kept as-is: it is decoded exactly
+    once, by the DFPWM conversion, instead of being re-encoded here first.
+    """
+    if find_audio_file(video_id):
         return
     
-    # Check for cookies to help with bot detection
-    # yt-dlp needs cookies in Netscape format, but we can try to extract from headers_auth.json
-    cookies_file = None
-    cookie_string = None
-    if os.path.exists("headers_auth.json"):
-        try:
-            with open("headers_auth.json", 'r') as f:
-                headers_data = json.load(f)
-                # Extract cookie string if available
-                if 'cookie' in headers_data:
-                    cookie_string = headers_data['cookie']
-        except:
-            pass
-    
-    # Check for WARP proxy (Cloudflare WARP in proxy mode)
-    # Default WARP proxy is SOCKS5 on 127.0.0.1:40000
-    warp_proxy = os.environ.get('WARP_PROXY', 'socks5://127.0.0.1:40000')
-    use_warp = os.environ.get('USE_WARP', 'false').lower() == 'true'
-    
     max_retries = 3
     for attempt in range(max_retries):
         try:
-            # Build yt-dlp options optimized for cloud/VPS environments
-            ydl_opts = {
-                'format': 'bestaudio/best',
-                'outtmpl': audio_file.replace('.m4a', '.%(ext)s'),
-                'quiet': True,
-                'no_warnings': True,
-                # Better user agent to avoid bot detection
-                'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
-                'referer': 'https://www.youtube.com/',
-                # Use WARP proxy if enabled
-                'proxy': warp_proxy if use_warp else None,
-                # Additional options to reduce bot detection for cloud IPs
-                'extractor_args': {
-                    'youtube': {
-                        'player_client': ['android', 'ios', 'web'],  # Try multiple clients
-                        'player_skip': ['webpage', 'configs'],  # Skip some checks
-                    }
-                },
-                # Add cookies via headers if we have them
-                'http_headers': {
-                    'Cookie': cookie_string
-                } if cookie_string else None,
-                # Additional options for cloud environments
-                'sleep_interval': 1,  # Add small delay between requests
-                'sleep_interval_requests': 1,
-                'postprocessors': [{
-                    'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'm4a',
-                    'preferredquality': '192',
-                }],
-            }
-            
-            # Remove None values
-            ydl_opts = {k: v for k, v in ydl_opts.items() if v is not None}
-            # Handle http_headers separately
-            if not cookie_string:
-                ydl_opts.pop('http_headers', None)
+            url = f"https://www.youtube.com/watch?v={video_id}"
+            rate_limit_sync("ytdlp")
+            get_ydl('audio').download([url])
             
-            if use_warp:
-                print(f"Using WARP proxy: {warp_proxy}")
-            
-            with YoutubeDL(ydl_opts) as ydl:
-                url = f"https://www.youtube.com/watch?v={video_id}"
-                ydl.download([url])
-                
-                # Rename to .m4a if needed
-                for ext in ['m4a', 'mp3', 'webm', 'opus']:
-                    temp_file = audio_file.replace('.m4a', f'.{ext}')
-                    if os.path.exists(temp_file):
-                        if ext != 'm4a':
-                            os.rename(temp_file, audio_file)
-                        print(f"Successfully downloaded audio for {video_id}")
-                        return  # Success
-                break  # Success
+            if find_audio_file(video_id):
+                print(f"Successfully downloaded audio for {video_id}")
+                return  # Success
+            break
                 
         except Exception as e:
             error_msg = str(e).lower()
@@ -293,3 +194,61 @@ def ensure_audio_downloaded(video_id: str):
                     print("  4. Pre-downloading audio files manually")
                 break
 
+def stream_audio_download(video_id: str, write: Callable[[bytes], None]) -> str:
+    """
+    Download a video's native audio stream, passing every block to write()
+    as it arrives (e.g. into ffmpeg's stdin) while also saving it to the
+    audio cache. Returns the path of the saved file.
+    """
+    from yt_dlp.networking import Request
+    
+    ydl = get_ydl('audio')
+    url = f"https://www.youtube.com/watch?v={video_id}"
+    rate_limit_sync("ytdlp")
+    info = ydl.extract_info(url, download=False)
+    # Only a single plain HTTP(S) file can be streamed; DASH/HLS formats (http_dash_segments,
+    # m3u8...) point at a manifest, so the caller falls back to a normal yt-dlp download
+    if info.get('protocol') not in ('http', 'https'):
+        raise Exception(f"Can't stream {info.get('protocol')} formats")
+    
+    audio_file = os.path.join(AUDIO_CACHE_DIR, f"{video_id}.{info['ext']}")
+    temp_file = audio_file + ".part"
+    headers = dict(info.get('http_headers') or {})
+    # YouTube throttles unranged requests, so fetch in the chunks yt-dlp would use
+    chunk_size = (info.get('downloader_options') or {}).get('http_chunk_size')
+    total = info.get('filesize')
+    position = 0
+    
+    try:
+        with open(temp_file, 'wb') as f:
+            while True:
+                if chunk_size:
+                    headers['Range'] = f"bytes={position}-{position + chunk_size - 1}"
+                response = ydl.urlopen(Request(info['url'], headers=headers))
+                received = 0
+                try:
+                    content_range = response.headers.get('Content-Range', '')
+                    if not total and '/' in content_range and not content_range.endswith('*'):
+                        total = int(content_range.rsplit('/', 1)[1])
+                    while True:
+                        data = response.read(STREAM_READ_SIZE)
+                        if not data:
+                            break
+                        f.write(data)
+                        write(data)
+                        received += len(data)
+                finally:
+                    response.close()
+                
+                position += received
+                if not chunk_size or received < chunk_size or (total and position >= total):
+                    break
+        
+        os.replace(temp_file, audio_file)
+    except Exception:
+        if os.path.exists(temp_file):
+            os.remove(temp_file)
+        raise
+    
+    print(f"Successfully streamed audio for {video_id}")
+    return audio_file
@@ -0,0 +1,73 @@
+import os
+import time
+import asyncio
+import threading
+from typing import Dict, Tuple
+
+# (requests per second, burst) per upstream service
+# Override with e.g. RATE_LIMIT_YTMUSIC=2:4
+DEFAULT_LIMITS: Dict[str, Tuple[float, int]] = {
+    'ytmusic': (2.0, 4),  # ytmusicapi (search, song info, lyrics, playlists)
+    'ytdlp': (1.0, 2),  # yt-dlp extraction and downloads
+    'thumbnails': (10.0, 10),  # img.youtube.com artwork
+}
+
+class TokenBucket:
+    """
+    Thread-safe token bucket. Callers reserve a token up front and wait for
+    it outside the lock, so waiters are served in order without polling.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self) -> float:
+        """Take a token, returning how long to wait before using it (seconds)"""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # Tokens may go negative: that's the queue of callers already waiting
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / self.rate
+
+    async def acquire(self):
+        """Wait for a token without blocking the event loop"""
+        delay = self.reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def acquire_sync(self):
+        """Wait for a token from a worker thread"""
+        delay = self.reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+def _load_limits() -> Dict[str, TokenBucket]:
+    buckets = {}
+    for upstream, (rate, burst) in DEFAULT_LIMITS.items():
+        setting = os.environ.get(f"RATE_LIMIT_{upstream.upper()}")
+        if setting:
+            try:
+                rate_text, _, burst_text = setting.partition(':')
+                new_rate = float(rate_text)
+                new_burst = int(burst_text) if burst_text else burst
+                # A zero rate would never refill the bucket (and divides by zero)
+                if not new_rate > 0 or new_burst < 1:
+                    raise ValueError(setting)
+                rate, burst = new_rate, new_burst
+            except ValueError:
+                print(f"Warning: Invalid RATE_LIMIT_{upstream.upper()}={setting!r}, using {rate}:{burst}")
+        buckets[upstream] = TokenBucket(rate, burst)
+    return buckets
+
+_buckets = _load_limits()
+
+def get_bucket(upstream: str) -> TokenBucket:
+    return _buckets[upstream]
@@ -1,12 +1,27 @@
-from typing import List, Dict
+from typing import List, Dict, Optional, Tuple
 import re
-import time
+import asyncio
 import os
-from api import get_ytmusic, rate_limit, is_bot_detection_error, reset_ytmusic
+import time
+from api import call_ytmusic, rate_limit, is_bot_detection_error
+from api.cache import TTLCache
+from api.executor import run_io
+from api.clients import get_ydl
+from api.store import store
+
+# How long search results are reused (seconds)
+SEARCH_CACHE_TTL = float(os.environ.get('SEARCH_CACHE_TTL', str(6 * 3600)))
+
+# Normalized query -> (max_results searched for, results)
+_search_cache = TTLCache(SEARCH_CACHE_TTL, max_entries=512)
+# Normalized query -> (max_results, task) of searches in progress
+_search_inflight: Dict[str, Tuple[int, asyncio.Task]] = {}
 
 async def search_youtube_music(query: str, max_results: int = 10) -> List[Dict]:
     """
     Search YouTube Music and return results in the format expected by the Lua client.
+    Results are cached per normalized query; a cached search for more results
+    also answers requests for fewer, and identical concurrent searches share one lookup.
     Returns: List of {id, title, artist, duration}
     """
     # Check if query is a direct video ID or URL
@@ -15,12 +30,79 @@ async def search_youtube_music(query: str, max_results: int = 10) -> List[Dict]:
         # Return single result for direct video ID
         return [{"id": video_id, "title": query, "artist": "Unknown", "duration": "?"}]
     
+    key = normalize_query(query)
+    cached = _get_cached_search(key, max_results)
+    if cached is not None:
+        return cached
+    
+    inflight = _search_inflight.get(key)
+    if inflight is None or inflight[0] < max_results:
+        # The lookup runs as its own task so a cancelled request doesn't cancel it for the others
+        task = asyncio.ensure_future(_search_and_store(query, key, max_results))
+        task.add_done_callback(lambda done: done.cancelled() or done.exception())
+        inflight = (max_results, task)
+        _search_inflight[key] = inflight
+    results = await asyncio.shield(inflight[1])
+    return results[:max_results]
+
+async def _search_and_store(query: str, key: str, max_results: int) -> List[Dict]:
+    try:
+        results = await _search_uncached(query, max_results)
+        if results:
+            _store_search(key, max_results, results)
+        return results
+    finally:
+        if _search_inflight.get(key, (0, None))[1] is asyncio.current_task():
+            del _search_inflight[key]
+
+def normalize_query(query: str) -> str:
+    """Case- and whitespace-insensitive form of a query, used as the cache key"""
+    return " ".join(query.casefold().split())
+
+def _get_cached_search(key: str, max_results: int) -> Optional[List[Dict]]:
+    """Cached results for a query if a search for at least max_results is cached"""
+    entry = _search_cache.get(key)
+    if entry is None:
+        # Not in memory, try the persistent cache
+        stored = store.get_entry("search", key)
+        if stored is None:
+            return None
+        data, updated = stored
+        age = time.time() - updated
+        if age > SEARCH_CACHE_TTL:
+            return None
+        entry = (data['maxResults'], data['results'])
+        _search_cache.set(key, entry, SEARCH_CACHE_TTL - age)
+    
+    searched, results = entry
+    if searched < max_results:
+        return None
+    return results[:max_results]
+
+def _store_search(key: str, max_results: int, results: List[Dict]):
+    """Cache results in memory and persistently, unless a larger search is already cached"""
+    entry = _search_cache.get(key)
+    if entry is not None and entry[0] > max_results:
+        return
+    stored = store.get("search", key, max_age=SEARCH_CACHE_TTL)
+    if stored is not None and stored["maxResults"] > max_results:
+        return
+    _search_cache.set(key, (max_results, results))
+    try:
+        store.put("search", key, {"maxResults": max_results, "results": results})
+    except Exception as e:
+        print(f"Warning: Failed to cache search results: {e}")
+
+def search_cache_stats() -> Dict:
+    return _search_cache.stats()
+
+async def _search_uncached(query: str, max_results: int) -> List[Dict]:
+    """Search YouTube Music (falling back to yt-dlp) without the cache"""
     # Try YTMusic with retry logic
     max_retries = 2
     for attempt in range(max_retries):
         try:
-            rate_limit()  # Add delay between requests
-            ytmusic = get_ytmusic()  # Get fresh instance
+            await rate_limit()  # Add delay between requests
             
             # Check if using OAuth - OAuth does NOT support filter parameter (causes HTTP 400)
             using_oauth = os.path.exists("oauth.json") and os.path.exists("oauth_config.json")
@@ -30,7 +112,7 @@ async def search_youtube_music(query: str, max_results: int = 10) -> List[Dict]:
             if using_oauth:
                 # With OAuth, NEVER use filter - it causes HTTP 400
                 try:
-                    results = ytmusic.search(query, limit=max_results * 2)  # Get more results to filter
+                    results = await run_io(call_ytmusic, "search", query, limit=max_results * 2)  # Get more results to filter
                     # Filter results to songs manually - keep only results with videoId
                     if results:
                         results = [r for r in results if r.get("videoId") and r.get("resultType") in ["song", "video"]]
@@ -46,13 +128,13 @@ async def search_youtube_music(query: str, max_results: int = 10) -> List[Dict]:
             else:
                 # With headers auth, try with filter first
                 try:
-                    results = ytmusic.search(query, filter="songs", limit=max_results)
+                    results = await run_io(call_ytmusic, "search", query, filter="songs", limit=max_results)
                 except Exception as filter_error:
                     # If filter fails, try without filter
                     error_msg = str(filter_error).lower()
                     if "400" in str(filter_error) or "invalid" in error_msg or "bad request" in error_msg:
                         print(f"Search with filter failed, trying without filter...")
-                        results = ytmusic.search(query, limit=max_results * 2)
+                        results = await run_io(call_ytmusic, "search", query, limit=max_results * 2)
                         # Filter results to songs manually
                         if results:
                             results = [r for r in results if r.get("videoId")]
@@ -93,9 +175,8 @@ async def search_youtube_music(query: str, max_results: int = 10) -> List[Dict]:
                     # Wait before retry with exponential backoff
                     wait_time = (attempt + 1) * 2
                     print(f"Retrying in {wait_time} seconds...")
-                    time.sleep(wait_time)
-                    # Try resetting YTMusic instance
-                    reset_ytmusic()
+                    # The failing session was quarantined, the retry gets a fresh one
+                    await asyncio.sleep(wait_time)
                     continue
                 else:
                     # Final attempt failed, try yt-dlp fallback
@@ -117,41 +198,28 @@ async def search_youtube_music(query: str, max_results: int = 10) -> List[Dict]:
 async def search_youtube_music_ytdlp(query: str, max_results: int = 10) -> List[Dict]:
     """Fallback: Search using yt-dlp"""
     try:
-        from yt_dlp import YoutubeDL
+        def extract():
+            # Search using yt-dlp
+            search_query = f"ytsearch{max_results}:{query}"
+            return get_ydl('flat').extract_info(search_query, download=False)
         
-        # Check for WARP proxy
-        warp_proxy = os.environ.get('WARP_PROXY', 'socks5://127.0.0.1:40000')
-        use_warp = os.environ.get('USE_WARP', 'false').lower() == 'true'
+        await rate_limit("ytdlp")
+        info = await run_io(extract)
         
-        ydl_opts = {
-            'quiet': True,
-            'no_warnings': True,
-            'extract_flat': True,
-            'default_search': 'ytsearch',
-            'playlistend': max_results,
-            'proxy': warp_proxy if use_warp else None,
-        }
-        ydl_opts = {k: v for k, v in ydl_opts.items() if v is not None}
+        if not info or 'entries' not in info:
+            return []
         
-        with YoutubeDL(ydl_opts) as ydl:
-            # Search using yt-dlp
-            search_query = f"ytsearch{max_results}:{query}"
-            info = ydl.extract_info(search_query, download=False)
-            
-            if not info or 'entries' not in info:
-                return []
-            
-            formatted_results = []
-            for entry in info.get('entries', []):
-                if entry and 'id' in entry:
-                    formatted_results.append({
-                        "id": entry['id'],
-                        "title": entry.get('title', 'Unknown'),
-                        "artist": entry.get('uploader', 'Unknown Artist'),
-                        "duration": entry.get('duration_string', '?')
-                    })
-            
-            return formatted_results
+        formatted_results = []
+        for entry in info.get('entries', []):
+            if entry and 'id' in entry:
+                formatted_results.append({
+                    "id": entry['id'],
+                    "title": entry.get('title', 'Unknown'),
+                    "artist": entry.get('uploader', 'Unknown Artist'),
+                    "duration": entry.get('duration_string', '?')
+                })
+        
+        return formatted_results
     except Exception as e:
         print(f"yt-dlp search error: {e}")
         return []
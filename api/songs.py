@@ -0,0 +1,25 @@
+import os
+from typing import Dict, Optional
+from api import call_ytmusic, rate_limit
+from api.cache import TTLCache
+from api.executor import run_io
+
+# How long ytmusicapi song info is reused (seconds)
+SONG_INFO_TTL = float(os.environ.get('SONG_INFO_TTL', '3600'))
+
+_song_info_cache = TTLCache(SONG_INFO_TTL, max_entries=1024)
+
+async def get_song_info(video_id: str) -> Optional[Dict]:
+    """
+    ytmusicapi get_song() result for a video, shared by metadata and lyrics.
+    Cached for SONG_INFO_TTL; concurrent requests for the same video share one call.
+    Errors are raised (and not cached).
+    """
+    async def fetch():
+        await rate_limit()  # Add delay between requests
+        return await run_io(call_ytmusic, "get_song", video_id)
+
+    return await _song_info_cache.get_or_load(video_id, fetch)
+
+def song_info_stats() -> Dict:
+    return _song_info_cache.stats()
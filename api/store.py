@@ -0,0 +1,310 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import re
+import threading
+from abc import ABC, abstractmethod
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+# Cache backend (set before starting the server)
+# CACHE_BACKEND: "sqlite" (one database file) or "files" (one file per item, the old layout)
+# CACHE_FLUSH_INTERVAL: seconds between batched SQLite writes
+CACHE_DIR = "cache"
+CACHE_DB = os.path.join(CACHE_DIR, "cache.db")
+CACHE_BACKEND = os.environ.get('CACHE_BACKEND', 'sqlite').lower()
+CACHE_FLUSH_INTERVAL = float(os.environ.get('CACHE_FLUSH_INTERVAL', '1.0'))
+
+# Namespaces of small JSON records, and their directory/extension in the file layout.
+# Artwork is stored as plain text.
+NAMESPACES = {
+    'metadata': ('metadata', '.json'),
+    'lyrics': ('lyrics', '.json'),
+    'artwork': ('artwork', '.txt'),
+    'search': ('search', '.json'),
+    'thumbnails': ('thumbnails', '.json'),  # Which size exists, validators (the images are .jpg files)
+    'playlists': ('playlists', '.json'),
+}
+
+# Entries not written for this long are removed by purge_expired() (seconds, 0 = kept forever).
+# Override per namespace with CACHE_MAX_AGE_<NAMESPACE>, e.g. CACHE_MAX_AGE_ARTWORK=86400
+DAY = 24 * 3600
+CACHE_MAX_AGES = {
+    namespace: float(os.environ.get(f'CACHE_MAX_AGE_{namespace.upper()}', str(default)))
+    for namespace, default in {
+        'metadata': 30 * DAY,
+        'lyrics': 30 * DAY,
+        'artwork': 7 * DAY,  # One entry per size/mode, re-rendered from the thumbnail when needed
+        'search': DAY,
+        'thumbnails': 30 * DAY,
+        'playlists': 7 * DAY,
+    }.items()
+}
+
+class CacheStore(ABC):
+    """Key/value store for cached records, grouped by namespace. Values are JSON-serializable."""
+
+    def get(self, namespace: str, key: str, max_age: Optional[float] = None) -> Optional[Any]:
+        """Stored value, or None if missing (or older than max_age seconds)"""
+        entry = self.get_entry(namespace, key)
+        if entry is None:
+            return None
+        value, updated = entry
+        if max_age is not None and time.time() - updated > max_age:
+            return None
+        return value
+
+    @abstractmethod
+    def get_entry(self, namespace: str, key: str) -> Optional[Tuple[Any, float]]:
+        """(value, time stored) or None"""
+
+    @abstractmethod
+    def put(self, namespace: str, key: str, value: Any, updated: Optional[float] = None):
+        """Store a value; updated defaults to now"""
+
+    @abstractmethod
+    def delete(self, namespace: str, key: str):
+        """Remove an entry (if present)"""
+
+    @abstractmethod
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any, float]]:
+        """All (key, value, time stored) of a namespace"""
+
+    def purge(self, namespace: str, max_age: float) -> int:
+        """Delete entries older than max_age seconds, returning how many were removed"""
+        cutoff = time.time() - max_age
+        expired = [key for key, _, updated in self.items(namespace) if updated < cutoff]
+        for key in expired:
+            self.delete(namespace, key)
+        return len(expired)
+
+    def purge_expired(self, max_ages: Dict[str, float] = CACHE_MAX_AGES) -> int:
+        """Purge every namespace by its max age, returning how many entries were removed"""
+        removed = 0
+        for namespace, max_age in max_ages.items():
+            if max_age > 0:
+                removed += self.purge(namespace, max_age)
+        return removed
+
+    def flush(self):
+        """Write out pending changes"""
+
+    def close(self):
+        self.flush()
+
+class FileStore(CacheStore):
+    """One file per record under cache/<namespace>/ (the original layout)"""
+
+    def __init__(self, root: str = CACHE_DIR):
+        self.root = root
+
+    def _path(self, namespace: str, key: str) -> str:
+        directory, ext = NAMESPACES[namespace]
+        if not re.match(r'^[A-Za-z0-9_-]+$', key):
+            # Keys like search queries aren't safe file names
+            key = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.root, directory, key + ext)
+
+    @staticmethod
+    def _decode(namespace: str, text: str) -> Any:
+        return text if NAMESPACES[namespace][1] == '.txt' else json.loads(text)
+
+    def get_entry(self, namespace: str, key: str) -> Optional[Tuple[Any, float]]:
+        path = self._path(namespace, key)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                text = f.read()
+            return self._decode(namespace, text), os.path.getmtime(path)
+        except (OSError, ValueError):
+            return None
+
+    def put(self, namespace: str, key: str, value: Any, updated: Optional[float] = None):
+        path = self._path(namespace, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            if isinstance(value, str) and NAMESPACES[namespace][1] == '.txt':
+                f.write(value)
+            else:
+                json.dump(value, f, ensure_ascii=False)
+        if updated is not None:
+            os.utime(path, (updated, updated))
+
+    def delete(self, namespace: str, key: str):
+        try:
+            os.remove(self._path(namespace, key))
+        except OSError:
+            pass
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any, float]]:
+        directory, ext = NAMESPACES[namespace]
+        directory = os.path.join(self.root, directory)
+        if not os.path.isdir(directory):
+            return
+        for name in os.listdir(directory):
+            if not name.endswith(ext):
+                continue
+            path = os.path.join(directory, name)
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    value = self._decode(namespace, f.read())
+                yield name[:-len(ext)], value, os.path.getmtime(path)
+            except (OSError, ValueError) as e:
+                print(f"Warning: Skipping unreadable cache file {path}: {e}")
+
+class SQLiteStore(CacheStore):
+    """
+    All records in one SQLite database (WAL mode). Writes are buffered and
+    committed in batches by a background thread; reads see buffered writes.
+    """
+
+    def __init__(self, path: str = CACHE_DB, flush_interval: float = CACHE_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._local = threading.local()
+        self._pending: Dict[Tuple[str, str], Optional[Tuple[str, float]]] = {}  # None = delete
+        self._pending_lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._open_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._opened = False
+        self._closed = False
+
+    def _open(self):
+        """
+        Create the database and start the writer on first use, not on import:
+        the encoder's worker processes import the api modules too.
+        """
+        if self._opened:
+            return
+        with self._open_lock:
+            if self._opened:
+                return
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            conn = self._thread_connection()
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS entries (
+                    namespace TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    updated REAL NOT NULL,
+                    PRIMARY KEY (namespace, key)
+                ) WITHOUT ROWID
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS entries_updated ON entries (namespace, updated)")
+            conn.commit()
+
+            self._writer = threading.Thread(target=self._write_loop, name="cache-store-writer")
+            self._writer.daemon = True
+            self._writer.start()
+            self._opened = True
+
+    def _connection(self) -> sqlite3.Connection:
+        self._open()
+        return self._thread_connection()
+
+    def _thread_connection(self) -> sqlite3.Connection:
+        """One connection per thread"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30)
+            # WAL keeps the database consistent with NORMAL; the last moments may be lost on power failure
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get_entry(self, namespace: str, key: str) -> Optional[Tuple[Any, float]]:
+        with self._pending_lock:
+            if (namespace, key) in self._pending:
+                pending = self._pending[(namespace, key)]
+                return None if pending is None else (json.loads(pending[0]), pending[1])
+
+        row = self._connection().execute(
+            "SELECT value, updated FROM entries WHERE namespace = ? AND key = ?", (namespace, key)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, namespace: str, key: str, value: Any, updated: Optional[float] = None):
+        self._queue(namespace, key, (json.dumps(value, ensure_ascii=False), updated or time.time()))
+
+    def delete(self, namespace: str, key: str):
+        self._queue(namespace, key, None)
+
+    def _queue(self, namespace: str, key: str, entry: Optional[Tuple[str, float]]):
+        self._open()
+        with self._pending_lock:
+            self._pending[(namespace, key)] = entry
+            count = len(self._pending)
+        if count >= 100 or self._closed:
+            self._wakeup.set()
+
+    def items(self, namespace: str) -> Iterator[Tuple[str, Any, float]]:
+        self.flush()
+        rows = self._connection().execute(
+            "SELECT key, value, updated FROM entries WHERE namespace = ?", (namespace,)
+        ).fetchall()
+        for key, value, updated in rows:
+            yield key, json.loads(value), updated
+
+    def purge(self, namespace: str, max_age: float) -> int:
+        self.flush()
+        with self._write_lock:
+            conn = self._connection()
+            cursor = conn.execute(
+                "DELETE FROM entries WHERE namespace = ? AND updated < ?", (namespace, time.time() - max_age)
+            )
+            conn.commit()
+            return cursor.rowcount
+
+    def flush(self):
+        with self._write_lock:
+            with self._pending_lock:
+                pending = dict(self._pending)
+            if not pending:
+                return
+
+            writes = [(ns, key, entry[0], entry[1]) for (ns, key), entry in pending.items() if entry is not None]
+            deletes = [(ns, key) for (ns, key), entry in pending.items() if entry is None]
+            conn = self._connection()
+            with conn:  # One transaction per batch
+                if writes:
+                    conn.executemany(
+                        "INSERT OR REPLACE INTO entries (namespace, key, value, updated) VALUES (?, ?, ?, ?)", writes
+                    )
+                if deletes:
+                    conn.executemany("DELETE FROM entries WHERE namespace = ? AND key = ?", deletes)
+
+            # Keep entries readable from the buffer until they're committed, and keep newer changes queued
+            with self._pending_lock:
+                for item, entry in pending.items():
+                    if item in self._pending and self._pending[item] is entry:
+                        del self._pending[item]
+
+    def _write_loop(self):
+        while not self._closed:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Cache store write error: {e}")
+
+    def close(self):
+        self._closed = True
+        if not self._opened:
+            return
+        self._wakeup.set()
+        self.flush()
+
+def create_store(backend: str = CACHE_BACKEND) -> CacheStore:
+    if backend == 'sqlite':
+        return SQLiteStore()
+    if backend == 'files':
+        return FileStore()
+    raise ValueError(f"Unknown CACHE_BACKEND: {backend}")
+
+# Process-wide store used by the api modules
+store = create_store()
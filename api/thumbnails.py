@@ -0,0 +1,119 @@
+import os
+import time
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from typing import Optional
+from api import rate_limit_sync
+from api.store import store
+
+THUMBNAIL_CACHE_DIR = os.path.join("cache", "thumbnails")
+os.makedirs(THUMBNAIL_CACHE_DIR, exist_ok=True)
+
+# THUMBNAIL_TTL: seconds a stored thumbnail is used before revalidating it (conditional request)
+# THUMBNAIL_MISSING_TTL: seconds a video without any thumbnail isn't asked for again
+THUMBNAIL_TTL = float(os.environ.get('THUMBNAIL_TTL', str(7 * 24 * 3600)))
+THUMBNAIL_MISSING_TTL = float(os.environ.get('THUMBNAIL_MISSING_TTL', '3600'))
+
+# Best first; hqdefault exists for every video, maxresdefault often doesn't
+THUMBNAIL_SIZES = ["maxresdefault", "hqdefault"]
+
+_session: Optional[requests.Session] = None
+_session_lock = threading.Lock()
+
+def get_session() -> requests.Session:
+    """Shared keep-alive session for img.youtube.com"""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=2, pool_maxsize=16)
+            _session.mount("https://", adapter)
+        return _session
+
+def _thumbnail_path(video_id: str) -> str:
+    return os.path.join(THUMBNAIL_CACHE_DIR, f"{video_id}.jpg")
+
+def fetch_thumbnail(video_id: str) -> Optional[bytes]:
+    """
+    Raw thumbnail bytes for a video, in the best size available, or None if it has none.
+    Thumbnails are stored on disk and revalidated with a conditional request
+    after THUMBNAIL_TTL; the size that worked is remembered per video.
+    Blocking - run it via run_io.
+    """
+    path = _thumbnail_path(video_id)
+    info = store.get("thumbnails", video_id) or {}
+
+    if info.get("missing") and time.time() - info.get("checked", 0) < THUMBNAIL_MISSING_TTL:
+        return None
+
+    data = None
+    if info.get("size") and os.path.exists(path):
+        with open(path, 'rb') as f:
+            data = f.read()
+        if time.time() - info.get("checked", 0) < THUMBNAIL_TTL:
+            return data
+
+    # Start from the size that worked last time
+    sizes = THUMBNAIL_SIZES
+    if info.get("size") in sizes:
+        sizes = sizes[sizes.index(info["size"]):]
+
+    for size in sizes:
+        headers = {}
+        if data is not None and size == info.get("size"):
+            # Revalidate what we have
+            if info.get("etag"):
+                headers["If-None-Match"] = info["etag"]
+            if info.get("lastModified"):
+                headers["If-Modified-Since"] = info["lastModified"]
+
+        rate_limit_sync("thumbnails")
+        url = f"https://img.youtube.com/vi/{video_id}/{size}.jpg"
+        response = get_session().get(url, headers=headers, timeout=5)
+
+        if response.status_code == 304 and data is not None:
+            info["checked"] = time.time()
+            store.put("thumbnails", video_id, info)
+            return data
+        if response.status_code == 200:
+            with open(path + ".part", 'wb') as f:
+                f.write(response.content)
+            os.replace(path + ".part", path)
+            store.put("thumbnails", video_id, {
+                "size": size,
+                "etag": response.headers.get("ETag"),
+                "lastModified": response.headers.get("Last-Modified"),
+                "checked": time.time(),
+            })
+            return response.content
+        if response.status_code != 404:
+            # Server trouble: use what we have, don't remember the failure
+            print(f"Thumbnail error for {video_id}: HTTP {response.status_code}")
+            return data
+
+    # No thumbnail in any size
+    if os.path.exists(path):
+        os.remove(path)
+    store.put("thumbnails", video_id, {"missing": True, "checked": time.time()})
+    return None
+
+def purge_thumbnails() -> int:
+    """
+    Delete stored images whose record is gone (purged after CACHE_MAX_AGE_THUMBNAILS,
+    or marked missing), returning how many were removed. Called by the janitor.
+    """
+    if not os.path.isdir(THUMBNAIL_CACHE_DIR):
+        return 0
+    kept = {key for key, info, _ in store.items("thumbnails") if info.get("size")}
+    removed = 0
+    for item in os.scandir(THUMBNAIL_CACHE_DIR):
+        video_id, ext = os.path.splitext(item.name)
+        if ext != '.jpg' or video_id in kept:
+            continue
+        try:
+            os.remove(item.path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
@@ -0,0 +1,197 @@
+import os
+import json
+import threading
+import requests
+from typing import Any, Callable, Dict, List, Tuple
+from ytmusicapi import YTMusic, OAuthCredentials
+from api.executor import submit_io
+
+OAUTH_FILE = "oauth.json"
+OAUTH_CONFIG_FILE = "oauth_config.json"
+AUTH_FILE = "headers_auth.json"
+
+# Auth messages are printed once, not once per pooled client
+_announced = set()
+
+def _announce(key: str, *lines: str):
+    if key not in _announced:
+        _announced.add(key)
+        for line in lines:
+            print(line)
+
+def create_client() -> Tuple[YTMusic, str]:
+    """
+    Create a YTMusic client with its own requests.Session, using OAuth
+    authentication (preferred) or the headers_auth.json fallback.
+    OAuth is more reliable and less prone to bot detection errors.
+
+    Priority:
+    1. OAuth (oauth.json + oauth_config.json with client_id/client_secret)
+    2. headers_auth.json (cookie-based, may expire)
+    3. No authentication (may trigger bot detection)
+
+    Returns: (client, auth method) - auth method is "oauth", "headers" or "none"
+    """
+    session = requests.Session()
+
+    # Try OAuth first (preferred method)
+    if os.path.exists(OAUTH_FILE) and os.path.exists(OAUTH_CONFIG_FILE):
+        try:
+            # Load OAuth credentials
+            with open(OAUTH_CONFIG_FILE, 'r') as f:
+                oauth_config = json.load(f)
+
+            client_id = oauth_config.get('client_id')
+            client_secret = oauth_config.get('client_secret')
+
+            if client_id and client_secret:
+                oauth_credentials = OAuthCredentials(
+                    client_id=client_id,
+                    client_secret=client_secret
+                )
+                client = YTMusic(OAUTH_FILE, requests_session=session, oauth_credentials=oauth_credentials)
+                _announce("oauth", "Using OAuth authentication")
+                return client, "oauth"
+            else:
+                _announce("oauth-config", "Warning: oauth_config.json missing client_id or client_secret")
+        except Exception as e:
+            print(f"Warning: Failed to use OAuth authentication: {e}")
+            print("Falling back to headers_auth.json...")
+
+    # Fallback to headers_auth.json
+    if os.path.exists(AUTH_FILE):
+        try:
+            client = YTMusic(AUTH_FILE, requests_session=session)
+            _announce("headers", "Using headers_auth.json authentication")
+            return client, "headers"
+        except Exception as e:
+            print(f"Warning: Failed to use {AUTH_FILE}, falling back to default: {e}")
+            print("Your cookies may have expired. Try refreshing headers_auth.json or setting up OAuth")
+            return YTMusic(requests_session=session), "none"
+
+    # Try without auth (may trigger bot detection)
+    _announce(
+        "none",
+        "Warning: No authentication found. Bot detection errors may occur.",
+        "Set up OAuth (recommended) or headers_auth.json (see README.md)"
+    )
+    return YTMusic(requests_session=session), "none"
+
+PoolEntry = Tuple[int, YTMusic]  # (generation, client)
+
+class YTMusicPool:
+    """
+    Thread-safe pool of up to `size` YTMusic clients, created on first use.
+    Each call checks a client out exclusively, so concurrent requests run in
+    parallel on separate sessions. Clients that fail with a session error
+    (bot detection, expired auth) are quarantined and replaced in the background.
+    """
+
+    def __init__(self, size: int, is_session_error: Callable[[Exception], bool]):
+        self.size = max(1, size)
+        self._is_session_error = is_session_error
+        self._idle: List[PoolEntry] = []
+        self._created = 0
+        self._generation = 0  # Bumped by reset(); older clients are dropped when returned
+        self._cond = threading.Condition()
+        self._verified = False
+        self.quarantined = 0
+
+    def call(self, method: str, *args, **kwargs) -> Any:
+        """Call a YTMusic method on a pooled client (blocking, run it via run_io)"""
+        entry = self._checkout()
+        try:
+            result = getattr(entry[1], method)(*args, **kwargs)
+        except Exception as e:
+            healthy = not self._is_session_error(e)
+            if not healthy:
+                print(f"Quarantining YTMusic session after {method} error: {e}")
+            self._checkin(entry, healthy)
+            raise
+        self._checkin(entry, True)
+        return result
+
+    def reset(self):
+        """Drop every client (e.g. after refreshing cookies); clients in use are dropped when returned"""
+        with self._cond:
+            self._generation += 1
+            self._created -= len(self._idle)
+            self._idle.clear()
+            self._cond.notify_all()
+
+    def stats(self) -> Dict:
+        with self._cond:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "idle": len(self._idle),
+                "quarantined": self.quarantined,
+            }
+
+    def _checkout(self) -> PoolEntry:
+        with self._cond:
+            while not self._idle and self._created >= self.size:
+                self._cond.wait()
+            if self._idle:
+                return self._idle.pop()
+            self._created += 1
+            generation = self._generation
+
+        try:
+            client, auth = create_client()
+        except Exception:
+            self._release_slot()
+            raise
+        if auth == "oauth" and not self._verified:
+            self._verified = True
+            # Checking OAuth costs a request; don't make the first caller wait for it
+            submit_io(self._verify_oauth)
+        return generation, client
+
+    def _checkin(self, entry: PoolEntry, healthy: bool):
+        with self._cond:
+            if healthy and entry[0] == self._generation:
+                self._idle.append(entry)
+                self._cond.notify()
+                return
+            if not healthy:
+                self.quarantined += 1
+            self._created -= 1
+            self._cond.notify()
+        if not healthy:
+            submit_io(self._replace)
+
+    def _release_slot(self):
+        with self._cond:
+            self._created -= 1
+            self._cond.notify()
+
+    def _replace(self):
+        """Create a fresh client for a quarantined one (runs in the I/O pool)"""
+        with self._cond:
+            if self._created >= self.size:
+                return
+            self._created += 1
+            generation = self._generation
+        try:
+            client, _ = create_client()
+        except Exception as e:
+            print(f"Warning: Failed to replace YTMusic session: {e}")
+            self._release_slot()
+            return
+        self._checkin((generation, client), True)
+
+    def _verify_oauth(self):
+        """Check that OAuth works, only to print a helpful warning if it doesn't"""
+        try:
+            # Try to get library (this will fail if OAuth isn't working)
+            self.call("get_library_playlists", limit=1)
+            print("OAuth verified: Authentication is working")
+        except Exception as test_error:
+            error_msg = str(test_error).lower()
+            if "400" in str(test_error) or "invalid" in error_msg or "unauthorized" in error_msg:
+                print(f"Warning: OAuth may not be working properly: {test_error}")
+                print("OAuth credentials may be invalid or expired. Try re-running 'ytmusicapi oauth'")
+            else:
+                # Other errors are OK, OAuth is probably working
+                print("OAuth initialized (test skipped due to non-auth error)")
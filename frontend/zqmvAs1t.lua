@@ -161,6 +161,8 @@ local state = {
     -- Queue support
     queue = {},
     queueIndex = 1,
+    -- Playlist whose remaining pages are fetched as the queue runs low: {id, complete}
+    playlist = nil,
     -- Double-tap back button: last tap time (ms) for go-back-a-song
     lastBackTapTime = 0,
     backLockUntil = 0,
@@ -352,16 +354,25 @@ local function parseDuration(durationStr)
     return 0
 end
 
-local function hexToBytes(hexData)
-    if type(hexData) ~= "string" or #hexData == 0 then
-        return nil
+local function getHeader(headers, name)
+    if type(headers) ~= "table" then return nil end
+    name = name:lower()
+    for k, v in pairs(headers) do
+        if type(k) == "string" and k:lower() == name then
+            return v
+        end
     end
+    return nil
+end
 
-    local out = {}
-    for i = 1, #hexData, 2 do
-        out[#out + 1] = string.char(tonumber(hexData:sub(i, i + 1), 16) or 0)
-    end
-    return table.concat(out)
+-- Fetch a raw DFPWM chunk (format=binary); returns data, done, headers
+local function fetchAudioChunk(url)
+    local resp = http.get(url .. "&format=binary", nil, true)
+    if not resp then return nil, false end
+    local headers = resp.getResponseHeaders()
+    local body = resp.readAll() or ""
+    resp.close()
+    return body, getHeader(headers, "X-Audio-Done") == "1", headers
 end
 
 local function getTimestampedLyrics(lyrics)
@@ -647,6 +658,15 @@ local function processSong(videoId)
     state.song = data
     state.duration = data.duration or 0
 
+    -- Let the server prepare the next tracks while this one plays
+    local upcoming = {}
+    for i = state.queueIndex + 1, math.min(#state.queue, state.queueIndex + 10) do
+        table.insert(upcoming, state.queue[i].id)
+    end
+    httpPost(SERVER .. "/api/nowplaying", {
+        videoId = data.id, queue = #upcoming > 0 and upcoming or nil, clientId = tostring(os.getComputerID())
+    })
+
     state.lyrics = {}
     if data.hasLyrics then
         local lBody = httpGet(SERVER .. "/api/lyrics/" .. data.id)
@@ -655,7 +675,8 @@ local function processSong(videoId)
         end
     end
 
-    local aBody = httpGet(SERVER .. "/api/artwork/" .. data.id)
+    -- Binary: one byte per character, as term.blit expects
+    local aBody = httpGet(SERVER .. "/api/artwork/" .. data.id, true)
     if aBody then
         state.artwork = {}
         for line in aBody:gmatch("[^\n]+") do
@@ -1110,41 +1131,34 @@ local function audioThread()
         local rawL, rawR
 
         if isStereo then
-            local bodyL = httpGet(SERVER .. "/api/audio/" .. state.song.id .. "/chunk?channel=left&offset=" .. state.audioOffset .. "&size=" .. CHUNK_SIZE)
-            local bodyR = httpGet(SERVER .. "/api/audio/" .. state.song.id .. "/chunk?channel=right&offset=" .. state.audioOffset .. "&size=" .. CHUNK_SIZE)
+            -- One request returns left bytes followed by right bytes
+            local body, isDone, headers = fetchAudioChunk(SERVER .. "/api/audio/" .. state.song.id .. "/chunk?channel=stereo&offset=" .. state.audioOffset .. "&size=" .. CHUNK_SIZE)
+            local channelSize = tonumber(getHeader(headers, "X-Audio-Channel-Size")) or 0
 
-            if not bodyL or not bodyR then
+            if not body then
                 sleep(0.5)
+            elseif channelSize > 0 and #body >= channelSize * 2 then
+                rawL = body:sub(1, channelSize)
+                rawR = body:sub(channelSize + 1, channelSize * 2)
+                done = isDone
+            elseif isDone then
+                state.audioEOF = true
             else
-                local respL = textutils.unserialiseJSON(bodyL)
-                local respR = textutils.unserialiseJSON(bodyR)
-
-                if respL and respL.data and #respL.data > 0 and respR and respR.data then
-                    rawL = hexToBytes(respL.data)
-                    rawR = hexToBytes(respR.data)
-                    if respL.done then done = true end
-                elseif respL and respL.done then
-                    done = true
-                else
-                    sleep(0.5)
-                end
+                sleep(0.5)
             end
         else
-            local body = httpGet(SERVER .. "/api/audio/" .. state.song.id .. "/chunk?offset=" .. state.audioOffset .. "&size=" .. CHUNK_SIZE)
+            local body, isDone = fetchAudioChunk(SERVER .. "/api/audio/" .. state.song.id .. "/chunk?offset=" .. state.audioOffset .. "&size=" .. CHUNK_SIZE)
 
             if not body then
                 sleep(0.5)
+            elseif #body > 0 then
+                rawL = body
+                rawR = rawL
+                done = isDone
+            elseif isDone then
+                state.audioEOF = true
             else
-                local resp = textutils.unserialiseJSON(body)
-                if resp and resp.data and #resp.data > 0 then
-                    rawL = hexToBytes(resp.data)
-                    rawR = rawL
-                    if resp.done then done = true end
-                elseif resp and resp.done then
-                    done = true
-                else
-                    sleep(0.5)
-                end
+                sleep(0.5)
             end
         end
 
@@ -1299,8 +1313,12 @@ local function isPlaylistId(str)
     return str:match("^PL") or str:match("^OLA") or str:match("^RDCLAK") or str:match("^VL") or str:match("^UU") or str:match("^OLAK")
 end
 
-local function fetchPlaylist(playlistId)
-    local body = httpPost(SERVER .. "/api/playlist", { playlistId = playlistId })
+local PLAYLIST_PAGE = 100
+
+local function fetchPlaylist(playlistId, offset)
+    local body = httpPost(SERVER .. "/api/playlist", {
+        playlistId = playlistId, offset = offset or 0, limit = PLAYLIST_PAGE, clientId = tostring(os.getComputerID())
+    })
     if not body then return nil end
     local data = textutils.unserialiseJSON(body)
     if not data or data.error then return nil end
@@ -1309,6 +1327,16 @@ end
 
 local function cacheThread()
     while state.playing and not state.quit do
+        local pl = state.playlist
+        if pl and not pl.complete and #state.queue - state.queueIndex < 5 then
+            pcall(function()
+                local page = fetchPlaylist(pl.id, #state.queue)
+                if page and state.playlist == pl then
+                    for _, track in ipairs(page.tracks or {}) do table.insert(state.queue, track) end
+                    pl.complete = page.complete or #(page.tracks or {}) == 0
+                end
+            end)
+        end
         if #state.queue > state.queueIndex then
             local nextVideo = state.queue[state.queueIndex + 1]
             if not state.nextCached or state.nextCached ~= nextVideo.id then
@@ -1389,12 +1417,13 @@ local function chatThread()
                         chatSend("| Loading...")
                         local pl = fetchPlaylist(args)
                         if pl and pl.tracks and #pl.tracks > 0 then
-                            chatSend("| " .. (pl.title or "Playlist") .. " (" .. #pl.tracks .. " songs)")
+                            chatSend("| " .. (pl.title or "Playlist") .. " (" .. (pl.total or #pl.tracks) .. " songs)")
                             if state.playing then state.audioEOF = true state.playing = false
                                 for _, s in ipairs(allSpeakers) do s.stop() end sleep(0.5) end
                             state.queue = pl.tracks
                             state.queueIndex = 1
                             state.nextCached = nil
+                            state.playlist = { id = args, complete = pl.complete ~= false }
                             if processSong(pl.tracks[1].id) then
                                 chatSend("| " .. (pl.tracks[1].title or "Playing"))
                             end
@@ -1411,6 +1440,7 @@ local function chatThread()
                         state.queue = {{id = args, title = "Video " .. args}}
                         state.queueIndex = 1
                         state.nextCached = nil
+                        state.playlist = nil
                         state.playing = false
                         state.paused = false
                         state.audioEOF = false
@@ -1477,6 +1507,7 @@ local function chatThread()
                 state.queue = {}
                 state.queueIndex = 1
                 state.nextCached = nil
+                state.playlist = nil
                 chatSend("| Queue cleared")
             end
         elseif waitingForSelection then
@@ -1491,6 +1522,7 @@ local function chatThread()
                 state.queue = {result}
                 state.queueIndex = 1
                 state.nextCached = nil
+                state.playlist = nil
                 state.playing = false
                 state.paused = false
                 state.audioEOF = false
@@ -1539,6 +1571,7 @@ local function main()
             state.queue = {input}
             state.queueIndex = 1
             state.nextCached = nil
+            state.playlist = nil
             
             -- Start playback
             processSong(input.id)
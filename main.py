@@ -1,17 +1,29 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import FileResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-from typing import Optional, List
+from pydantic import BaseModel, Field
+from typing import Optional, List, Tuple
 import uvicorn
 import os
 import json
 
-from api.search import search_youtube_music
+from api.search import search_youtube_music, search_cache_stats
 from api.process import process_video
 from api.lyrics import get_lyrics
-from api.artwork import get_artwork
-from api.audio import get_audio_chunk
+from api.artwork import get_artwork, ARTWORK_MODES, MAX_ARTWORK_WIDTH, MAX_ARTWORK_HEIGHT
+from api.audio import (
+    CHANNELS, get_audio_chunk, read_audio_chunk, get_stereo_chunk, read_stereo_chunk,
+    get_dfpwm_file, iter_dfpwm_file, iter_dfpwm_job, forget_failed_job, is_download_pending,
+    DOWNLOAD_RETRY_AFTER
+)
 from api.playlist import get_playlist
+from api import executor, ytmusic_stats
+from api.blockcache import block_cache
+from api.store import store
+from api.janitor import janitor
+from api.downloads import download_scheduler
+from api.songs import song_info_stats
+from api.prefetch import prefetcher, upcoming_tracks
 
 app = FastAPI(title="CC:Tweaked YouTube Music Backend")
 
@@ -34,6 +46,15 @@ class ProcessRequest(BaseModel):
 
 class PlaylistRequest(BaseModel):
     playlistId: str
+    offset: int = Field(0, ge=0)
+    limit: Optional[int] = Field(None, ge=1)
+    clientId: Optional[str] = None  # Prefetches are tracked per client (defaults to its address)
+
+class NowPlayingRequest(BaseModel):
+    videoId: str
+    playlistId: Optional[str] = None
+    queue: Optional[List[str]] = None  # Upcoming video IDs, if the client has its own queue
+    clientId: Optional[str] = None
 
 # Endpoints
 @app.post("/api/search")
@@ -64,32 +85,194 @@ async def lyrics(video_id: str):
         return []
 
 @app.get("/api/artwork/{video_id}")
-async def artwork(video_id: str):
-    """Get ASCII artwork for a video"""
+async def artwork(video_id: str,
+                  width: int = Query(20, ge=1, le=MAX_ARTWORK_WIDTH),
+                  height: int = Query(10, ge=1, le=MAX_ARTWORK_HEIGHT),
+                  mode: str = "ascii",
+                  dither: bool = False):
+    """
+    Get artwork for a video as plain text, one "text|fg|bg" line per row.
+    mode: ascii, or teletext for 2x3 sub-pixels per character (CC drawing characters)
+    Sent as ISO-8859-1, one byte per character like term.blit expects
+    (UTF-8 would turn every drawing character into two bytes).
+    """
+    if mode not in ARTWORK_MODES:
+        raise HTTPException(status_code=400, detail=f"Invalid mode: {mode}")
     try:
-        artwork_data = await get_artwork(video_id)
-        return artwork_data
+        artwork_data = await get_artwork(video_id, width, height, mode, dither)
     except Exception as e:
-        return ""
+        artwork_data = ""
+    # Content-Type as a header: with media_type Starlette would append "; charset=utf-8"
+    return Response(content=artwork_data.encode("latin-1"), headers={"Content-Type": "text/plain; charset=iso-8859-1"})
+
+def _chunk_headers(chunk: dict) -> dict:
+    """Status headers for binary audio chunk responses"""
+    headers = {
+        "X-Audio-Done": "1" if chunk["done"] else "0",
+        "X-Audio-Ready": str(chunk["ready"]),
+    }
+    if chunk["total"] is not None:
+        headers["X-Audio-Total"] = str(chunk["total"])
+    if "error" in chunk:
+        # Header values must be single-line latin-1
+        headers["X-Audio-Error"] = " ".join(chunk["error"].split()).encode("ascii", "replace").decode()
+    return headers
 
 @app.get("/api/audio/{video_id}/chunk")
-async def audio_chunk(video_id: str, offset: int = 0, size: int = 4096, channel: Optional[str] = None):
-    """Get audio chunk in DFPWM format"""
+async def audio_chunk(video_id: str, offset: int = 0, size: int = 4096, channel: Optional[str] = None, format: str = "json"):
+    """
+    Get audio chunk in DFPWM format.
+    format=json returns {data: hex, done}; format=binary returns the raw bytes
+    with X-Audio-Done / X-Audio-Ready / X-Audio-Total / X-Audio-Error headers.
+    channel=stereo returns left and right for the same offset together:
+    {left: hex, right: hex, done} in JSON, or left bytes followed by right
+    bytes in binary (each X-Audio-Channel-Size bytes long).
+    """
     try:
+        if channel == "stereo":
+            if format == "binary":
+                chunk = await read_stereo_chunk(video_id, offset, size)
+                headers = _chunk_headers(chunk)
+                headers["X-Audio-Channel-Size"] = str(len(chunk["left"]))
+                return Response(content=chunk["left"] + chunk["right"], media_type="application/octet-stream", headers=headers)
+            return await get_stereo_chunk(video_id, offset, size)
+        
+        if format == "binary":
+            chunk = await read_audio_chunk(video_id, offset, size, channel)
+            return Response(content=chunk["data"], media_type="application/octet-stream", headers=_chunk_headers(chunk))
+        
         result = await get_audio_chunk(video_id, offset, size, channel)
         return result
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+def _parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single "bytes=" Range header into an inclusive (start, end).
+    Returns None if the header should be ignored (multiple ranges, other units).
+    Raises ValueError if the range can't be satisfied.
+    """
+    unit, _, spec = range_header.partition("=")
+    if unit.strip().lower() != "bytes" or "," in spec:
+        return None
+    start_str, _, end_str = spec.strip().partition("-")
+    try:
+        if not start_str:
+            # Suffix range: the last N bytes
+            length = int(end_str)
+            if length <= 0:
+                raise ValueError("Empty suffix range")
+            return max(0, size - length), size - 1
+        start = int(start_str)
+        end = int(end_str) if end_str else size - 1
+    except ValueError:
+        raise ValueError(f"Invalid range: {range_header}")
+    if start >= size or end < start:
+        raise ValueError(f"Range not satisfiable: {range_header}")
+    return start, min(end, size - 1)
+
+@app.get("/api/audio/{video_id}.dfpwm")
+async def audio_file(video_id: str, request: Request, channel: Optional[str] = None):
+    """
+    Download a whole track as DFPWM.
+    Completed files support Range requests, ETag and If-None-Match/If-Range.
+    While the track is still converting the response streams the bytes as
+    they are encoded (chunked, Range is ignored). A track still waiting for
+    its download gets 503 with Retry-After.
+    """
+    if channel not in CHANNELS:
+        raise HTTPException(status_code=400, detail=f"Invalid channel: {channel}")
+    
+    path, job = await get_dfpwm_file(video_id, channel)
+    if job is not None:
+        # Conversions that fail right away get an error status instead of an empty 200
+        await job.wait_for(1)
+        if job.error:
+            forget_failed_job(job)
+            if not is_download_pending(video_id):
+                raise HTTPException(status_code=500, detail=f"Conversion failed: {job.error}")
+            job = None  # Streamed conversion failed, the scheduler falls back to a plain download
+        else:
+            return StreamingResponse(iter_dfpwm_job(job, channel), media_type="application/octet-stream")
+    if path is None:
+        if is_download_pending(video_id):
+            raise HTTPException(status_code=503, detail="Audio is still downloading",
+                                headers={"Retry-After": str(DOWNLOAD_RETRY_AFTER)})
+        raise HTTPException(status_code=404, detail="Audio file not available")
+    
+    stat = os.stat(path)
+    size = stat.st_size
+    etag = f'"{size:x}-{stat.st_mtime_ns:x}"'
+    headers = {"ETag": etag, "Accept-Ranges": "bytes"}
+    
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    
+    range_header = request.headers.get("range")
+    if_range = request.headers.get("if-range")
+    if range_header and (if_range is None or if_range == etag):
+        try:
+            byte_range = _parse_range(range_header, size)
+        except ValueError:
+            return Response(status_code=416, headers={**headers, "Content-Range": f"bytes */{size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(iter_dfpwm_file(path, start, end), status_code=206,
+                                     media_type="application/octet-stream", headers=headers)
+    
+    # Whole completed file
+    return FileResponse(path, media_type="application/octet-stream", headers=headers, stat_result=stat)
+
 @app.post("/api/playlist")
-async def playlist(request: PlaylistRequest):
-    """Get playlist tracks"""
+async def playlist(request: PlaylistRequest, http_request: Request):
+    """Get playlist tracks; loading a playlist from the start prefetches its first tracks"""
     try:
-        result = await get_playlist(request.playlistId)
+        result = await get_playlist(request.playlistId, request.offset, request.limit)
+        if request.offset == 0 and result.get("tracks"):
+            ids = [track["id"] for track in result["tracks"]]
+            prefetcher.now_playing(request.clientId or http_request.client.host, ids[0], ids[1:])
         return result
     except Exception as e:
         return {"error": str(e)}
 
+@app.post("/api/nowplaying")
+async def now_playing(request: NowPlayingRequest, http_request: Request):
+    """Tell the server which track a client plays, so the tracks after it are prepared ahead"""
+    upcoming = upcoming_tracks(request.videoId, request.playlistId, request.queue)
+    window = prefetcher.now_playing(request.clientId or http_request.client.host, request.videoId, upcoming)
+    return {"prefetch": window}
+
+@app.on_event("startup")
+async def startup():
+    """Start the cache janitor"""
+    janitor.start()
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stop the worker pools and write out pending cache entries"""
+    executor.shutdown()
+    store.close()
+
+@app.get("/api/status/{video_id}")
+async def status(video_id: str):
+    """Download/conversion status of a video: queued, downloading, converting, ready or failed"""
+    return download_scheduler.status(video_id)
+
+@app.get("/api/stats")
+async def stats():
+    """Cache and scheduler statistics"""
+    return {
+        "audioBlockCache": block_cache.stats(),
+        "downloads": download_scheduler.stats(),
+        "ytmusicPool": ytmusic_stats(),
+        "songInfo": song_info_stats(),
+        "search": search_cache_stats(),
+        "diskCache": janitor.stats(),
+        "prefetch": prefetcher.stats()
+    }
+
 @app.get("/")
 async def root():
     return {"status": "CC:Tweaked YouTube Music Backend", "version": "1.0.0"}
@@ -98,9 +281,6 @@ if __name__ == "__main__":
     # Create cache directories if they don't exist
     os.makedirs("cache", exist_ok=True)
     os.makedirs("cache/audio", exist_ok=True)
-    os.makedirs("cache/artwork", exist_ok=True)
-    os.makedirs("cache/lyrics", exist_ok=True)
-    os.makedirs("cache/metadata", exist_ok=True)
     os.makedirs("cache/dfpwm", exist_ok=True)
     
     # Check for authentication files
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""
+Import the old one-file-per-item caches (cache/metadata, cache/lyrics,
+cache/search) into the SQLite cache database. Old artwork renders are
+not imported: they're keyed by video only and use the old palette, so
+artwork is simply rendered again.
+Run this once from the server directory after upgrading. The old
+directories are left in place; pass --delete to remove imported files.
+"""
+import os
+import sys
+from api.store import FileStore, SQLiteStore, NAMESPACES, CACHE_DIR, CACHE_DB
+
+def migrate(delete: bool = False) -> int:
+    """Copy every cached record into the database, returning how many were imported"""
+    files = FileStore(CACHE_DIR)
+    database = SQLiteStore()
+    total = 0
+
+    for namespace, (directory, ext) in NAMESPACES.items():
+        if namespace == "artwork":
+            continue
+        count = 0
+        for key, value, updated in files.items(namespace):
+            if namespace == "search":
+                # Search files are named by hash; the query is stored inside
+                key = value.get("query")
+                if not key:
+                    continue
+                updated = value.get("time", updated)
+                value = {"maxResults": value["maxResults"], "results": value["results"]}
+            database.put(namespace, key, value, updated)
+            count += 1
+        database.flush()
+
+        if delete and count:
+            path = os.path.join(CACHE_DIR, directory)
+            for name in os.listdir(path):
+                if name.endswith(ext):
+                    os.remove(os.path.join(path, name))
+        print(f"{namespace}: {count} imported")
+        total += count
+
+    database.close()
+    return total
+
+if __name__ == "__main__":
+    print("Cache Migration")
+    print("=" * 40)
+    total = migrate(delete="--delete" in sys.argv[1:])
+    print("=" * 40)
+    print(f"✓ Imported {total} cache entries into {CACHE_DB}")